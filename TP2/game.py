@@ -21,7 +21,7 @@
 # For more info, see http://inst.eecs.berkeley.edu/~cs188/sp09/pacman.html
 
 from util import *
-import time, os
+import time, os, copy
 import traceback
 import sys
 
@@ -67,7 +67,28 @@ class Directions:
                WEST: EAST,
                STOP: STOP}
 
-class Configuration:
+class Slotted(object):
+    """
+    Base class of the objects allocated for every search node (configurations,
+    agent states, game states): they keep their attributes in __slots__
+    rather than in a per-instance dict, which makes them several times
+    smaller and quicker to create.  Provides the pickling support that
+    classes with __slots__ lack.
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name): state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+class Configuration(Slotted):
     """
     A Configuration holds the (x,y) coordinate of a character, along with its
     traveling direction.
@@ -75,6 +96,7 @@ class Configuration:
     The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
     horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
     """
+    __slots__ = ('pos', 'direction')
 
     def __init__(self, pos, direction):
         self.pos = pos
@@ -117,10 +139,11 @@ class Configuration:
             direction = self.direction # There is no stop direction
         return Configuration((x + dx, y+dy), direction)
 
-class AgentState:
+class AgentState(Slotted):
     """
     AgentStates hold the state of an agent (configuration, speed, scared, etc).
     """
+    __slots__ = ('start', 'configuration', 'isPacman', 'scaredTimer', 'numCarrying', 'numReturned')
 
     def __init__( self, startConfiguration, isPacman ):
         self.start = startConfiguration
@@ -161,10 +184,15 @@ class AgentState:
 
 class Grid:
     """
-    A 2-dimensional array of objects backed by a list of lists.  Data is accessed
-    via grid[x][y] where (x,y) are positions on a Pacman map with x horizontal,
+    A 2-dimensional array of booleans stored as a bitboard: a single int in
+    which bit (x * height + y) holds cell (x,y).  Data is accessed via
+    grid[x][y] where (x,y) are positions on a Pacman map with x horizontal,
     y vertical and the origin (0,0) in the bottom left corner.
 
+    Since the bitboard is an immutable int, copies, hashing, equality and
+    counting cost a handful of machine operations instead of a loop over the
+    board.
+
     The __str__ method constructs an output that is oriented like a pacman board.
     """
     def __init__(self, width, height, initialValue=False, bitRepresentation=None):
@@ -173,106 +201,144 @@ class Grid:
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(height)] for x in range(width)]
+        self.bits = 0
+        if initialValue:
+            self.bits = (1 << (width * height)) - 1
+        self._columns = None
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
     def __getitem__(self, i):
-        return self.data[i]
+        if self._columns is None:
+            self._columns = [GridColumn(self, x) for x in range(self.width)]
+        return self._columns[i]
 
     def __setitem__(self, key, item):
-        self.data[key] = item
+        column = self[key]
+        for y, value in enumerate(item):
+            column[y] = value
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_columns'] = None
+        return state
 
     def __str__(self):
-        out = [[str(self.data[x][y])[0] for x in range(self.width)] for y in range(self.height)]
+        out = [[str(self[x][y])[0] for x in range(self.width)] for y in range(self.height)]
         out.reverse()
         return '\n'.join([''.join(x) for x in out])
 
     def __eq__(self, other):
         if other == None: return False
-        return self.data == other.data
+        return self.bits == other.bits and self.width == other.width and self.height == other.height
 
     def __hash__(self):
-        # return hash(str(self))
-        base = 1
-        h = 0
-        for l in self.data:
-            for i in l:
-                if i:
-                    h += base
-                base *= 2
-        return hash(h)
+        return hash(self.bits)
 
     def copy(self):
-        g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+        g = copy.copy(self)
+        g._columns = None
         return g
 
     def deepCopy(self):
         return self.copy()
 
     def shallowCopy(self):
-        g = Grid(self.width, self.height)
-        g.data = self.data
+        # The bitboard is immutable, so a shallow copy is a full copy
+        return self.copy()
+
+    def copyAndSet(self, x, y, value):
+        """
+        Returns a copy of the grid with cell (x,y) set to value.
+        """
+        g = self.copy()
+        bit = 1 << (x * self.height + y)
+        if value:
+            g.bits |= bit
+        else:
+            g.bits &= ~bit
         return g
 
     def count(self, item =True ):
-        return sum([x.count(item) for x in self.data])
+        setCells = bin(self.bits).count('1')
+        if item:
+            return setCells
+        return self.width * self.height - setCells
 
     def asList(self, key = True):
+        bits = self.bits
+        if not key:
+            bits = ~bits & ((1 << (self.width * self.height)) - 1)
+        height = self.height
         list = []
-        for x in range(self.width):
-            for y in range(self.height):
-                if self[x][y] == key: list.append( (x,y) )
+        while bits:
+            lowest = bits & -bits
+            list.append( divmod(lowest.bit_length() - 1, height) )
+            bits ^= lowest
         return list
 
+    def asBitmask(self):
+        """
+        Returns the grid as a single int where bit (x * height + y) is set
+        for every true cell.  Useful as a compact, hashable key.
+        """
+        return self.bits
+
     def packBits(self):
         """
         Returns an efficient int list representation
 
         (width, height, bitPackedInts...)
+
+        Each packed int holds CELLS_PER_INT cells, the first cell in the
+        most significant bit.
         """
+        numCells = self.width * self.height
+        size = self.CELLS_PER_INT
+        # cells[i] is '1' when cell i is set
+        cells = bin(self.bits)[2:].zfill(numCells)[::-1] if numCells > 0 else ''
         bits = [self.width, self.height]
-        currentInt = 0
-        for i in range(self.height * self.width):
-            bit = self.CELLS_PER_INT - (i % self.CELLS_PER_INT) - 1
-            x, y = self._cellIndexToPosition(i)
-            if self[x][y]:
-                currentInt += 2 ** bit
-            if (i + 1) % self.CELLS_PER_INT == 0:
-                bits.append(currentInt)
-                currentInt = 0
-        bits.append(currentInt)
+        bits += [int(cells[i:i + size].ljust(size, '0'), 2) for i in range(0, numCells, size)]
+        if numCells % size == 0:
+            bits.append(0)
         return tuple(bits)
 
-    def _cellIndexToPosition(self, index):
-        x = index / self.height
-        y = index % self.height
-        return x, y
-
     def _unpackBits(self, bits):
         """
         Fills in data from a bit-level representation
         """
-        cell = 0
         for packed in bits:
-            for bit in self._unpackInt(packed, self.CELLS_PER_INT):
-                if cell == self.width * self.height: break
-                x, y = self._cellIndexToPosition(cell)
-                self[x][y] = bit
-                cell += 1
-
-    def _unpackInt(self, packed, size):
-        bools = []
-        if packed < 0: raise ValueError, "must be a positive integer"
-        for i in range(size):
-            n = 2 ** (self.CELLS_PER_INT - i - 1)
-            if packed >= n:
-                bools.append(True)
-                packed -= n
-            else:
-                bools.append(False)
-        return bools
+            if packed < 0: raise ValueError, "must be a positive integer"
+        numCells = self.width * self.height
+        cells = ''.join([bin(packed)[2:].zfill(self.CELLS_PER_INT) for packed in bits])[:numCells]
+        if cells == '': return
+        filled = (1 << len(cells)) - 1
+        self.bits = (self.bits & ~filled) | int(cells[::-1], 2)
+
+class GridColumn:
+    """
+    A view on column x of a Grid, so that grid[x][y] reads and writes the
+    bitboard of the grid.
+    """
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.offset = x * grid.height
+
+    def __getitem__(self, y):
+        if y < 0: y += self.grid.height
+        if y < 0 or y >= self.grid.height: raise IndexError('Grid index out of range')
+        return self.grid.bits >> (self.offset + y) & 1 == 1
+
+    def __setitem__(self, y, value):
+        if y < 0: y += self.grid.height
+        if y < 0 or y >= self.grid.height: raise IndexError('Grid index out of range')
+        if value:
+            self.grid.bits |= 1 << (self.offset + y)
+        else:
+            self.grid.bits &= ~(1 << (self.offset + y))
+
+    def __len__(self):
+        return self.grid.height
 
 def reconstituteGrid(bitRep):
     if type(bitRep) is not type((1,2)):
@@ -368,22 +434,146 @@ class Actions:
         return (x + dx, y + dy)
     getSuccessor = staticmethod(getSuccessor)
 
-class GameStateData:
+class AdjacencyTable:
     """
+    The legal moves of every open cell of a layout, compiled once per Layout
+    (see Layout.getAdjacency) and indexed by cell id x * height + y, so that
+    the game rules look them up instead of testing the walls on every call.
 
+    Positions in between grid points (scared ghosts) and wall cells fall back
+    to Actions.  The lists returned are fresh copies, which callers may edit.
+    """
+    def __init__(self, walls):
+        self.walls = walls
+        self.height = walls.height
+        self.actions = []
+        self.neighbors = []
+        self.ghostActions = []
+        for x in range(walls.width):
+            for y in range(walls.height):
+                if walls[x][y]:
+                    self.actions.append(None)
+                    self.neighbors.append(None)
+                    self.ghostActions.append(None)
+                    continue
+                actions = Actions.getPossibleActions(Configuration((x, y), Directions.STOP), walls)
+                self.actions.append(tuple(actions))
+                self.neighbors.append(tuple(Actions.getLegalNeighbors((x, y), walls)))
+                self.ghostActions.append(dict([(direction, tuple(AdjacencyTable.filterGhostActions(actions, direction)))
+                                               for direction in Actions._directions]))
+
+    def filterGhostActions(possibleActions, direction):
+        """
+        Ghosts cannot stop, and cannot turn around unless they
+        reach a dead end, but can turn 90 degrees at intersections.
+        """
+        possibleActions = list(possibleActions)
+        reverse = Actions.reverseDirection( direction )
+        if Directions.STOP in possibleActions:
+            possibleActions.remove( Directions.STOP )
+        if reverse in possibleActions and len( possibleActions ) > 1:
+            possibleActions.remove( reverse )
+        return possibleActions
+    filterGhostActions = staticmethod(filterGhostActions)
+
+    def getCell(self, position):
+        "The cell id of an open grid point, or None."
+        x, y = position
+        if x != int(x) or y != int(y) or self.walls[int(x)][int(y)]:
+            return None
+        return int(x) * self.height + int(y)
+
+    def getPossibleActions(self, config):
+        cell = self.getCell(config.pos)
+        if cell == None:
+            return Actions.getPossibleActions(config, self.walls)
+        return list(self.actions[cell])
+
+    def getGhostActions(self, config):
+        cell = self.getCell(config.pos)
+        if cell == None:
+            return AdjacencyTable.filterGhostActions(Actions.getPossibleActions(config, self.walls), config.direction)
+        return list(self.ghostActions[cell][config.direction])
+
+    def getLegalNeighbors(self, position):
+        cell = self.getCell(position)
+        if cell == None:
+            return Actions.getLegalNeighbors(position, self.walls)
+        return list(self.neighbors[cell])
+
+_ZOBRIST_KEYS = {}
+
+def _canonicalFeature(value):
+    "The feature with every number as a float, so that equal features have equal reprs."
+    if isinstance(value, tuple):
+        return tuple([_canonicalFeature(v) for v in value])
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+def zobristKey(feature):
     """
+    The random 64-bit key of a state feature such as ('food', cell) for the
+    Zobrist hash of GameStateData. Keys are derived from the feature itself
+    (splitmix64 of the hash of its repr) rather than drawn from the random
+    module, so the game's random sequence is untouched and keys are the same in
+    every process. The repr is used because hash() of numbers collides, e.g.
+    hash(-1) == hash(-2).
+    """
+    key = _ZOBRIST_KEYS.get(feature)
+    if key == None:
+        z = (hash(repr(_canonicalFeature(feature))) + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        z ^= z >> 31
+        # Signed, so that keys and their xors stay machine integers
+        key = _ZOBRIST_KEYS[feature] = int(z - (1 << 64) if z >> 63 else z)
+    return key
+
+def agentZobristKey(index, agentState):
+    "The Zobrist key of agent index's position, direction and scared timer."
+    if agentState == None: return 0
+    conf = agentState.configuration
+    if conf == None:
+        return zobristKey(('scared', index, agentState.scaredTimer))
+    return zobristKey(('agent', index, conf.pos)) ^ zobristKey(('direction', index, conf.direction)) ^ \
+           zobristKey(('scared', index, agentState.scaredTimer))
+
+class GameStateData(Slotted):
+    """
+
+    """
+    __slots__ = ('food', '_numFood', '_foodPositions', 'capsules', 'agentStates', 'layout', '_eaten', 'score',
+                 '_ownedAgents', '_foodEaten', '_foodAdded', '_capsuleEaten', '_agentMoved', '_lose', '_win',
+                 'scoreChange', '_hash')
+
     def __init__( self, prevState = None ):
         """
         Generates a new data packet by copying information from its predecessor.
+
+        The food grid, the capsule list and the agent states are shared with the
+        predecessor (copy-on-write): the game rules replace them rather than
+        editing them, and get agent states through writableAgentState.
+
+        The number of food pellets and the set of their positions are cached
+        in _numFood and _foodPositions; code changing the food must go
+        through removeFood to keep them in sync.
+
+        _hash is the Zobrist hash of the state, None until first needed;
+        GameState.generateSuccessor derives it from the predecessor's with
+        updateHash.
         """
         if prevState != None:
-            self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates( prevState.agentStates )
+            self.food = prevState.food
+            self._numFood = prevState._numFood
+            self._foodPositions = prevState._foodPositions
+            self.capsules = prevState.capsules
+            self.agentStates = prevState.agentStates[:]
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
 
+        self._ownedAgents = 0 # bitmask of the agent states not shared with the predecessor
         self._foodEaten = None
         self._foodAdded = None
         self._capsuleEaten = None
@@ -391,15 +581,21 @@ class GameStateData:
         self._lose = False
         self._win = False
         self.scoreChange = 0
+        self._hash = None
 
     def deepCopy( self ):
         state = GameStateData( self )
         state.food = self.food.deepCopy()
+        state.capsules = self.capsules[:]
+        state.agentStates = self.copyAgentStates( self.agentStates )
+        state._ownedAgents = ( 1 << len( state.agentStates ) ) - 1
+        state._eaten = self._eaten[:]
         state.layout = self.layout.deepCopy()
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
         state._capsuleEaten = self._capsuleEaten
+        state._hash = self._hash
         return state
 
     def copyAgentStates( self, agentStates ):
@@ -408,6 +604,23 @@ class GameStateData:
             copiedStates.append( agentState.copy() )
         return copiedStates
 
+    def removeFood( self, position ):
+        "Removes the food pellet at position, keeping the cached food count and positions up to date."
+        x, y = position
+        self.food = self.food.copyAndSet( x, y, False )
+        self._numFood -= 1
+        self._foodPositions = self._foodPositions - frozenset( [position] )
+
+    def writableAgentState( self, index ):
+        """
+        Returns the AgentState of agent index so that it can be modified,
+        copying it first if it is still shared with the predecessor.
+        """
+        if not ( self._ownedAgents >> index ) & 1:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._ownedAgents |= 1 << index
+        return self.agentStates[index]
+
     def __eq__( self, other ):
         """
         Allows two states to be compared.
@@ -422,19 +635,64 @@ class GameStateData:
 
     def __hash__( self ):
         """
-        Allows states to be keys of dictionaries.
+        Allows states to be keys of dictionaries: the Zobrist hash of the
+        features __eq__ compares, computed once and then maintained
+        incrementally from state to successor.
+        """
+        if self._hash == None:
+            self._hash = self.computeHash()
+        return self._hash
+
+    def computeHash( self ):
+        "The Zobrist hash of the state, computed from scratch."
+        h = zobristKey( ( 'score', self.score ) )
+        for index, agentState in enumerate( self.agentStates ):
+            h ^= agentZobristKey( index, agentState )
+        bits = self.food.bits
+        while bits:
+            low = bits & -bits
+            h ^= zobristKey( ( 'food', low.bit_length() - 1 ) )
+            bits ^= low
+        for capsule in self.capsules:
+            h ^= zobristKey( ( 'capsule', capsule ) )
+        return h
+
+    def updateHash( self, prevState ):
         """
-        for i, state in enumerate( self.agentStates ):
-            try:
-                int(hash(state))
-            except TypeError, e:
-                print e
-                #hash(state)
-        return int((hash(tuple(self.agentStates)) + 13*hash(self.food) + 113* hash(tuple(self.capsules)) + 7 * hash(self.score)) % 1048575 )
+        Derives the hash of this state from the hash of its predecessor in
+        time proportional to what changed: the agent states that were copied,
+        the food and capsules that were eaten and the score.
+        """
+        if prevState._hash == None:
+            self._hash = None
+            return
+        h = prevState._hash
+        owned = self._ownedAgents
+        index = 0
+        while owned:
+            if owned & 1:
+                h ^= agentZobristKey( index, prevState.agentStates[index] ) ^ \
+                     agentZobristKey( index, self.agentStates[index] )
+            owned >>= 1
+            index += 1
+        if self.food is not prevState.food:
+            bits = self.food.bits ^ prevState.food.bits
+            while bits:
+                low = bits & -bits
+                h ^= zobristKey( ( 'food', low.bit_length() - 1 ) )
+                bits ^= low
+        if self.capsules is not prevState.capsules:
+            for capsule in self.capsules:
+                h ^= zobristKey( ( 'capsule', capsule ) )
+            for capsule in prevState.capsules:
+                h ^= zobristKey( ( 'capsule', capsule ) )
+        if self.score != prevState.score:
+            h ^= zobristKey( ( 'score', self.score ) ) ^ zobristKey( ( 'score', prevState.score ) )
+        self._hash = h
 
     def __str__( self ):
         width, height = self.layout.width, self.layout.height
-        map = Grid(width, height)
+        map = [[None for y in range(height)] for x in range(width)]
         if type(self.food) == type((1,2)):
             self.food = reconstituteGrid(self.food)
         for x in range(width):
@@ -455,7 +713,9 @@ class GameStateData:
         for x, y in self.capsules:
             map[x][y] = 'o'
 
-        return str(map) + ("\nScore: %d\n" % self.score)
+        out = [''.join([map[x][y] for x in range(width)]) for y in range(height)]
+        out.reverse()
+        return '\n'.join(out) + ("\nScore: %d\n" % self.score)
 
     def _foodWallStr( self, hasFood, hasWall ):
         if hasFood:
@@ -489,6 +749,8 @@ class GameStateData:
         Creates an initial game state from a layout array (see layout.py).
         """
         self.food = layout.food.copy()
+        self._numFood = self.food.count()
+        self._foodPositions = frozenset( self.food.asList() )
         #self.capsules = []
         self.capsules = layout.capsules[:]
         self.layout = layout
@@ -502,6 +764,7 @@ class GameStateData:
                 if numGhosts == numGhostAgents: continue # Max ghosts reached already
                 else: numGhosts += 1
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
+        self._ownedAgents = ( 1 << len( self.agentStates ) ) - 1
         self._eaten = [False for a in self.agentStates]
 
 try:
@@ -583,6 +846,9 @@ class Game:
                 self.unmute()
                 self._agentCrash(i, quiet=True)
                 return
+            if ("setMoveTimeout" in dir(agent)):
+                # let anytime agents size their per-move search budget
+                agent.setMoveTimeout(self.rules.getMoveWarningTime(i), self.rules.getMaxTotalTime(i))
             if ("registerInitialState" in dir(agent)):
                 self.mute(i)
                 if self.catchExceptions:
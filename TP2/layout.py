@@ -14,10 +14,13 @@
 
 from util import manhattanDistance
 from game import Grid
+from game import AdjacencyTable
 import os
 import random
+import copy
 
 VISIBILITY_MATRIX_CACHE = {}
+LAYOUT_CACHE = {} # resolved path -> (modification time, parsed Layout)
 
 class Layout:
     """
@@ -35,31 +38,64 @@ class Layout:
         self.processLayoutText(layoutText)
         self.layoutText = layoutText
         self.totalFood = len(self.food.asList())
-        # self.initializeVisibilityMatrix()
+        self.adjacency = None
+        self.visibility = None # Built by initializeVisibilityMatrix on first use
 
     def getNumGhosts(self):
         return self.numGhosts
 
     def initializeVisibilityMatrix(self):
+        """
+        Computes, for every open cell and direction, the points an agent
+        standing there sees when facing that direction: every point, on the
+        grid or half way between two grid points (where scared ghosts are),
+        along the ray up to the first wall.
+
+        Each set is a bitmask over the half-step grid, bit 2x * 2height + 2y
+        standing for point (x, y): self.visibility maps a direction to the
+        list of masks by cell id x * height + y.  Each direction is swept
+        once, reusing the ray of the next cell along it.  Matrices are shared
+        by all layouts with the same walls.
+        """
         global VISIBILITY_MATRIX_CACHE
-        if reduce(str.__add__, self.layoutText) not in VISIBILITY_MATRIX_CACHE:
-            from game import Directions
-            vecs = [(-0.5,0), (0.5,0),(0,-0.5),(0,0.5)]
-            dirs = [Directions.NORTH, Directions.SOUTH, Directions.WEST, Directions.EAST]
-            vis = Grid(self.width, self.height, {Directions.NORTH:set(), Directions.SOUTH:set(), Directions.EAST:set(), Directions.WEST:set(), Directions.STOP:set()})
-            for x in range(self.width):
-                for y in range(self.height):
-                    if self.walls[x][y] == False:
-                        for vec, direction in zip(vecs, dirs):
-                            dx, dy = vec
-                            nextx, nexty = x + dx, y + dy
-                            while (nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)] :
-                                vis[x][y][direction].add((nextx, nexty))
-                                nextx, nexty = x + dx, y + dy
-            self.visibility = vis
-            VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)] = vis
-        else:
-            self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
+        key = (self.width, self.height, self.walls.asBitmask())
+        if key not in VISIBILITY_MATRIX_CACHE:
+            from game import Directions, Actions
+            halfHeight = 2 * self.height
+            def isOpen(x, y):
+                return 0 <= x < self.width and 0 <= y < self.height and not self.walls[x][y]
+            def pointBit(x2, y2):
+                "The bit of the point (x2 / 2, y2 / 2)."
+                if 0 <= x2 < 2 * self.width and 0 <= y2 < halfHeight:
+                    return 1 << (x2 * halfHeight + y2)
+                return 0
+
+            vis = {}
+            for direction in [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST]:
+                dx, dy = Actions.directionToVector(direction)
+                dx, dy = int(dx), int(dy)
+                masks = [0] * (self.width * self.height)
+                # Sweep against the direction so the next cell's ray is known
+                xs = range(self.width)
+                ys = range(self.height)
+                if dx > 0: xs.reverse()
+                if dy > 0: ys.reverse()
+                for x in xs:
+                    for y in ys:
+                        if not isOpen(x, y): continue
+                        mask = pointBit(2 * x + dx, 2 * y + dy)
+                        if isOpen(x + dx, y + dy):
+                            mask |= pointBit(2 * (x + dx), 2 * (y + dy)) | masks[(x + dx) * self.height + y + dy]
+                        masks[x * self.height + y] = mask
+                vis[direction] = masks
+            VISIBILITY_MATRIX_CACHE[key] = vis
+        self.visibility = VISIBILITY_MATRIX_CACHE[key]
+
+    def getAdjacency(self):
+        "The AdjacencyTable of the layout, compiled on first use."
+        if self.adjacency == None:
+            self.adjacency = AdjacencyTable(self.walls)
+        return self.adjacency
 
     def isWall(self, pos):
         x, col = pos
@@ -83,14 +119,30 @@ class Layout:
         return pos
 
     def isVisibleFrom(self, ghostPos, pacPos, pacDirection):
+        if self.visibility == None: self.initializeVisibilityMatrix()
+        if pacDirection not in self.visibility: return False
         row, col = [int(x) for x in pacPos]
-        return ghostPos in self.visibility[row][col][pacDirection]
+        x2, y2 = ghostPos[0] * 2, ghostPos[1] * 2
+        if x2 != int(x2) or y2 != int(y2) or not (0 <= x2 < 2 * self.width and 0 <= y2 < 2 * self.height):
+            return False
+        mask = self.visibility[pacDirection][row * self.height + col]
+        return (mask >> (int(x2) * 2 * self.height + int(y2))) & 1 == 1
 
     def __str__(self):
         return "\n".join(self.layoutText)
 
     def deepCopy(self):
-        return Layout(self.layoutText[:])
+        """
+        Returns a copy of the layout without parsing it again.  The walls never
+        change once parsed, so they are shared (with the tables compiled from
+        them); the food, capsules and agent positions are copied.
+        """
+        layout = copy.copy(self)
+        layout.food = self.food.copy()
+        layout.capsules = self.capsules[:]
+        layout.agentPositions = self.agentPositions[:]
+        layout.layoutText = self.layoutText[:]
+        return layout
 
     def processLayoutText(self, layoutText):
         """
@@ -129,21 +181,30 @@ class Layout:
             self.agentPositions.append( (int(layoutChar), (x,y)))
             self.numGhosts += 1
 def getLayout(name, back = 2):
-    if name.endswith('.lay'):
-        layout = tryToLoad('layouts/' + name)
-        if layout == None: layout = tryToLoad(name)
-    else:
-        layout = tryToLoad('layouts/' + name + '.lay')
-        if layout == None: layout = tryToLoad(name + '.lay')
-    if layout == None and back >= 0:
-        curdir = os.path.abspath('.')
-        os.chdir('..')
-        layout = getLayout(name, back -1)
-        os.chdir(curdir)
-    return layout
+    """
+    Loads a layout by name from the layouts directory (or the given path),
+    looking in the current directory and up to back + 1 parent directories.
+    """
+    if not name.endswith('.lay'): name += '.lay'
+    directory = os.curdir
+    for level in range(back + 2):
+        for fullname in [os.path.join(directory, 'layouts', name), os.path.join(directory, name)]:
+            layout = tryToLoad(fullname)
+            if layout != None: return layout
+        directory = os.path.join(directory, os.pardir)
+    return None
 
 def tryToLoad(fullname):
+    """
+    Returns the layout in a file, or None if there is no such file.  Parsed
+    layouts are cached per process until the file is modified; every caller
+    gets its own copy.
+    """
     if(not os.path.exists(fullname)): return None
-    f = open(fullname)
-    try: return Layout([line.strip() for line in f])
-    finally: f.close()
+    path = os.path.realpath(fullname)
+    mtime = os.path.getmtime(path)
+    if path not in LAYOUT_CACHE or LAYOUT_CACHE[path][0] != mtime:
+        f = open(fullname)
+        try: LAYOUT_CACHE[path] = (mtime, Layout([line.strip() for line in f]))
+        finally: f.close()
+    return LAYOUT_CACHE[path][1].deepCopy()
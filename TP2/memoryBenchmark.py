@@ -0,0 +1,78 @@
+# memoryBenchmark.py
+# ------------------
+# Measures the memory and time cost of a search node: the bytes a GameState
+# successor allocates on top of what it shares with its parent, and the time
+# generateSuccessor takes.
+#
+# Usage: python memoryBenchmark.py [-l mediumClassic] [-k 2] [-d 2]
+
+
+import gc, sys, time, types
+from optparse import OptionParser
+import layout
+from pacman import GameState
+
+STATIC_TYPES = (type, types.ClassType, types.ModuleType, types.FunctionType,
+                types.BuiltinFunctionType, types.MethodType)
+
+def reachable(root, seen, skip):
+    """
+    Adds to seen (id -> object) every object reachable from root, without
+    going through classes, modules, functions or the objects in skip.
+    """
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or id(obj) in skip or isinstance(obj, STATIC_TYPES):
+            continue
+        seen[id(obj)] = obj
+        stack.extend(gc.get_referents(obj))
+
+def successorBytes(parent, child, skip):
+    "The total size of the objects reachable from child but not from parent."
+    parentObjects = {}
+    reachable(parent, parentObjects, skip)
+    childObjects = {}
+    reachable(child, childObjects, skip)
+    return sum([sys.getsizeof(obj) for key, obj in childObjects.items() if key not in parentObjects])
+
+def expand(state, depth):
+    "Every (parent, successor) pair of a full game tree search of the given depth."
+    pairs = []
+    frontier = [state]
+    for ply in range(depth * state.getNumAgents()):
+        agentIndex = ply % state.getNumAgents()
+        nextFrontier = []
+        for parent in frontier:
+            if parent.isWin() or parent.isLose(): continue
+            for action in parent.getLegalActions(agentIndex):
+                child = parent.generateSuccessor(agentIndex, action)
+                pairs.append((parent, child))
+                nextFrontier.append(child)
+        frontier = nextFrontier
+    return pairs
+
+def run(layoutName, numGhosts, depth):
+    lay = layout.getLayout(layoutName)
+    state = GameState()
+    state.initialize(lay, numGhosts)
+    # The layout is static and shared by every state
+    skip = {}
+    reachable(lay, skip, {})
+
+    startTime = time.time()
+    pairs = expand(state, depth)
+    elapsed = time.time() - startTime
+
+    total = sum([successorBytes(parent, child, skip) for parent, child in pairs])
+    print 'Layout %s, %d ghosts, depth %d: %d successors' % (layoutName, numGhosts, depth, len(pairs))
+    print 'Bytes per GameState:          %.1f' % (total / float(len(pairs)))
+    print 'Microseconds per successor:   %.1f' % (1e6 * elapsed / len(pairs))
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('-l', '--layout', dest='layout', default='mediumClassic')
+    parser.add_option('-k', '--numghosts', type='int', dest='numGhosts', default=2)
+    parser.add_option('-d', '--depth', type='int', dest='depth', default=2)
+    options, otherjunk = parser.parse_args(sys.argv[1:])
+    run(options.layout, options.numGhosts, options.depth)
@@ -14,8 +14,11 @@
 
 from util import manhattanDistance
 from game import Directions
+from game import Actions
 import random, util
-import time
+import time, math
+import multiprocessing
+from collections import OrderedDict
 from pacman import SCARED_TIME
 
 from game import Agent
@@ -104,6 +107,235 @@ def scoreEvaluationFunction(currentGameState):
     return currentGameState.getScore()
 
 
+def parseBoolArg(value):
+    """
+      Agent arguments arrive as strings from the command line ('-a opt=True')
+      or as 1 when given without a value ('-a opt').
+    """
+    return str(value).lower() in ['true', '1', 'yes']
+
+
+def searchStateKey(state):
+    """
+      Returns a compact hashable key for a GameState: the configuration and
+      scared timer of every agent, the food bitmask, the capsules and the
+      score.  Two states with the same key evaluate identically.
+    """
+    data = state.data
+    agents = tuple([(agentState.configuration.pos, agentState.configuration.direction, agentState.scaredTimer)
+                    for agentState in data.agentStates])
+    return (agents, data.food.asBitmask(), tuple(data.capsules), data.score)
+
+
+class LRUCache:
+    """
+      A dictionary holding at most maxSize entries, evicting the least
+      recently used one when full, and counting its hits, misses and
+      evictions.
+    """
+
+    def __init__(self, maxSize=100000):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+          Returns the value stored for key, or None.
+        """
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries[key] = value # Mark as most recently used
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            del self.entries[key]
+        elif len(self.entries) >= self.maxSize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = value
+
+    def clear(self):
+        self.entries.clear()
+
+    def getStats(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        hitRate = self.hits / float(lookups) if lookups > 0 else 0.0
+        return "%s: %d entries, %d hits, %d misses (%.2f), %d evictions" % \
+               (self.__class__.__name__, len(self.entries), self.hits, self.misses, hitRate, self.evictions)
+
+
+class TranspositionTable(LRUCache):
+    """
+      A bounded table of search results keyed on (state key, agent to move,
+      remaining depth).  Each entry stores a value and whether it is the exact
+      minimax value or only a lower/upper bound of it (alpha-beta cutoffs).
+      The least recently used entry is evicted once maxSize is reached.
+    """
+    EXACT = 0
+    LOWERBOUND = 1
+    UPPERBOUND = 2
+
+    def makeKey(self, state, agentIndex, remainingDepth):
+        return (searchStateKey(state), agentIndex, remainingDepth)
+
+    def lookup(self, key):
+        """
+          Returns the (value, flag) entry stored for key, or None.
+        """
+        return self.get(key)
+
+    def store(self, key, value, flag=EXACT):
+        self.put(key, (value, flag))
+
+
+class EvaluationCache(LRUCache):
+    """
+      Wraps an evaluation function with a bounded cache of its values keyed
+      by searchStateKey, so that a leaf reached again (through another order
+      of moves, or in the next search) is not evaluated twice.  The least
+      recently used value is evicted once maxSize is reached.
+
+      Only worth it for deterministic evaluation functions: a noisy one gets
+      its noise frozen per state.
+    """
+
+    def __init__(self, evaluationFunction, maxSize=100000):
+        LRUCache.__init__(self, maxSize)
+        self.evaluationFunction = evaluationFunction
+
+    def __call__(self, state):
+        key = searchStateKey(state)
+        value = self.get(key)
+        if value is None:
+            value = self.evaluationFunction(state)
+            self.put(key, value)
+        return value
+
+
+class MoveOrdering:
+    """
+      Orders the moves of alpha-beta nodes so that cutoffs come early, with
+      any of the heuristics (tried in this order):
+
+        killers: the last two moves that caused a cutoff at the same depth
+                 and agent, which are likely to cut again in sibling nodes
+        history: moves weighted by the cutoffs they caused for the same
+                 agent, position and move, deeper searches weighing more
+        static:  Pacman moves closing in on the nearest food, and ghost moves
+                 closing in on Pacman (or fleeing him while scared)
+
+      It also counts the nodes searched and their cutoffs: the share of
+      cutoffs made by the first move tried tells how good the ordering is.
+    """
+    HEURISTICS = ('killers', 'history', 'static')
+
+    def __init__(self, heuristics=HEURISTICS):
+        for heuristic in heuristics:
+            if heuristic not in MoveOrdering.HEURISTICS:
+                raise Exception('Unknown move ordering heuristic: ' + heuristic)
+        self.heuristics = heuristics
+        self.killers = {}
+        self.history = {}
+        self.nodes = 0
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+
+    def newSearch(self):
+        "Forgets the killers, whose depths are relative to the previous root."
+        self.killers = {}
+
+    def agentPosition(self, state, agentIndex):
+        return state.data.agentStates[agentIndex].configuration.pos
+
+    def staticScore(self, state, agentIndex, action):
+        "Distance left to the agent's target after the move: lower is better."
+        x, y = Actions.getSuccessor(self.agentPosition(state, agentIndex), action)
+        if agentIndex == 0:
+            foodPositions = state.getFoodPositions()
+            if len(foodPositions) == 0:
+                return 0
+            return min([abs(x - fx) + abs(y - fy) for fx, fy in foodPositions])
+        pacmanX, pacmanY = state.getPacmanPosition()
+        distance = abs(x - pacmanX) + abs(y - pacmanY)
+        if state.data.agentStates[agentIndex].scaredTimer > 0:
+            return -distance
+        return distance
+
+    def order(self, state, agentIndex, depth, actions):
+        "Returns the actions sorted by the heuristics, ties keeping their order."
+        killers = []
+        if 'killers' in self.heuristics:
+            killers = self.killers.get((depth, agentIndex), [])
+        position = None
+        if 'history' in self.heuristics:
+            position = self.agentPosition(state, agentIndex)
+        useStatic = 'static' in self.heuristics
+
+        def sortKey(action):
+            killerRank = len(killers)
+            if action in killers:
+                killerRank = killers.index(action)
+            historyScore = 0
+            if position is not None:
+                historyScore = self.history.get((agentIndex, position, action), 0)
+            staticScore = 0
+            if useStatic:
+                staticScore = self.staticScore(state, agentIndex, action)
+            return (killerRank, -historyScore, staticScore)
+        return sorted(actions, key=sortKey)
+
+    def recordNode(self):
+        self.nodes += 1
+
+    def recordCutoff(self, state, agentIndex, depth, action, moveNumber, remainingDepth):
+        "Called when the moveNumber-th move tried at a node causes a cutoff."
+        self.cutoffs += 1
+        if moveNumber == 0:
+            self.firstMoveCutoffs += 1
+        if 'killers' in self.heuristics:
+            killers = self.killers.setdefault((depth, agentIndex), [])
+            if action not in killers:
+                killers.insert(0, action)
+                del killers[2:]
+        if 'history' in self.heuristics:
+            key = (agentIndex, self.agentPosition(state, agentIndex), action)
+            self.history[key] = self.history.get(key, 0) + remainingDepth * remainingDepth
+
+    def getStats(self):
+        return {'nodes': self.nodes, 'cutoffs': self.cutoffs, 'firstMoveCutoffs': self.firstMoveCutoffs}
+
+    def __str__(self):
+        cutoffRate = self.cutoffs / float(self.nodes) if self.nodes > 0 else 0.0
+        firstMoveRate = self.firstMoveCutoffs / float(self.cutoffs) if self.cutoffs > 0 else 0.0
+        return "MoveOrdering (%s): %d nodes, %d cutoffs (%.2f), %.2f of them on the first move" % \
+               (', '.join(self.heuristics), self.nodes, self.cutoffs, cutoffRate, firstMoveRate)
+
+
+class SearchTimeout(Exception):
+    """Raised inside a search when the move budget of an anytime search is spent"""
+    pass
+
+
+DEFAULT_MOVE_BUDGET = 1.0 # Seconds per move when the game rules give no timeout
+MOVES_PER_FOOD = 2        # Estimate of the moves left in a game, per food pellet left...
+MIN_MOVES_LEFT = 20       # ...and its floor, so that the last moves share what remains
+TOTAL_TIME_MARGIN = 0.8   # Fraction of the game's total time budgets are drawn from; the rest
+                          # pays for the iterations that always complete once it is spent
+
+
 class MultiAgentSearchAgent(Agent):
     """
       This class provides some common elements to all of your
@@ -117,12 +349,160 @@ class MultiAgentSearchAgent(Agent):
       Note: this is an abstract class: one that should not be instantiated.  It's
       only partially specified, and designed to be extended.  Agent (game.py)
       is another abstract class.
+
+      Passing useTranspositionTable=True (e.g. -a useTranspositionTable=True)
+      shares search results between transpositions of the same state through a
+      TranspositionTable holding at most tableSize entries.
+
+      Passing evalCache=True memoises the evaluation function in an
+      EvaluationCache holding at most evalCacheSize values.
+
+      Passing iterativeDeepening=True turns AlphaBetaAgent and ExpectimaxAgent
+      into anytime searchers: they search depth 1, 2, 3... (up to maxDepth)
+      until the move budget is spent.  The budget is timeBudget seconds if
+      given, otherwise timeFraction of the game rules' move warning time.
+      It never exceeds the move warning time, nor the share of the game
+      rules' total time left for the estimated number of moves left.
     """
 
-    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2'):
+    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', useTranspositionTable = 'False', tableSize = '100000',
+                 iterativeDeepening = 'False', timeBudget = '0', timeFraction = '0.1', maxDepth = '100',
+                 evalCache = 'False', evalCacheSize = '100000'):
         self.index = 0 # Pacman is always agent index 0
         self.evaluationFunction = util.lookup(evalFn, globals())
+        if parseBoolArg(evalCache):
+            self.evaluationFunction = EvaluationCache(self.evaluationFunction, int(evalCacheSize))
         self.depth = int(depth)
+        self.transpositionTable = None
+        if parseBoolArg(useTranspositionTable):
+            self.transpositionTable = TranspositionTable(int(tableSize))
+        self.iterativeDeepening = parseBoolArg(iterativeDeepening)
+        self.timeBudget = float(timeBudget)
+        self.timeFraction = float(timeFraction)
+        self.maxDepth = int(maxDepth)
+        self.moveTimeout = None
+        self.maxTotalTime = None
+        self.timeUsed = 0.0
+        self.deadline = None
+        self.bestMoves = None
+        self.reachedDepthLimit = False
+        self.completedDepth = 0
+
+    def setMoveTimeout(self, moveTimeout, maxTotalTime=None):
+        "Called by the Game with the rules' move warning time and total time before the game starts."
+        self.moveTimeout = moveTimeout
+        self.maxTotalTime = maxTotalTime
+        self.timeUsed = 0.0
+
+    def getMoveBudget(self, gameState=None):
+        """
+          Seconds the next move may take.  The time left in the game is split
+          between the moves left, estimated from the food left in gameState.
+        """
+        if self.timeBudget > 0:
+            budget = self.timeBudget
+        elif self.moveTimeout is not None:
+            budget = self.timeFraction * self.moveTimeout
+        else:
+            budget = DEFAULT_MOVE_BUDGET
+        if self.moveTimeout is not None:
+            budget = min(budget, self.moveTimeout)
+        if self.maxTotalTime is not None:
+            movesLeft = MIN_MOVES_LEFT
+            if gameState is not None:
+                movesLeft = max(movesLeft, MOVES_PER_FOOD * gameState.getNumFood())
+            timeLeft = max(0.0, TOTAL_TIME_MARGIN * self.maxTotalTime - self.timeUsed)
+            budget = min(budget, timeLeft / movesLeft)
+        return budget
+
+    def recordMoveTime(self, startTime):
+        "Adds the time since startTime to the time used in the game."
+        self.timeUsed += time.time() - startTime
+
+    def checkDeadline(self):
+        if self.deadline is not None and time.time() > self.deadline:
+            raise SearchTimeout()
+
+    def searchRoot(self, gameState):
+        """
+          Runs a complete search to self.depth and returns the chosen action.
+        """
+        util.raiseNotDefined()
+
+    def iterativeDeepeningAction(self, gameState):
+        """
+          Calls searchRoot with depth 1, 2, 3... until the move budget is spent
+          and returns the action of the last completed iteration.  The first
+          iteration always completes.  The best action found at each node is
+          kept in self.bestMoves so that the next iteration explores the
+          previous best line first.
+        """
+        fixedDepth = self.depth
+        startTime = time.time()
+        bestAction = None
+        self.bestMoves = {}
+        self.completedDepth = 0
+        try:
+            for depth in range(1, self.maxDepth + 1):
+                self.depth = depth
+                if depth > 1:
+                    self.deadline = startTime + self.getMoveBudget(gameState)
+                self.reachedDepthLimit = False
+                try:
+                    bestAction = self.searchRoot(gameState)
+                except SearchTimeout:
+                    break
+                self.completedDepth = depth
+                if not self.reachedDepthLimit:
+                    break # Every line ended in a terminal state; deeper searches would not change anything
+        finally:
+            self.depth = fixedDepth
+            self.deadline = None
+            self.bestMoves = None
+            self.recordMoveTime(startTime)
+        return bestAction
+
+    def bestMoveKey(self, state, agentIndex):
+        "Key of a node in self.bestMoves, or None when moves are not being recorded."
+        if self.bestMoves is None:
+            return None
+        return (searchStateKey(state), agentIndex)
+
+    def orderActions(self, moveKey, actions):
+        "Moves the best action of the previous iteration to the front."
+        if moveKey is None:
+            return actions
+        best = self.bestMoves.get(moveKey)
+        if best not in actions:
+            return actions
+        return [best] + [action for action in actions if action != best]
+
+    def recordBestAction(self, moveKey, action):
+        if moveKey is not None:
+            self.bestMoves[moveKey] = action
+
+    def tableKey(self, state, agentIndex, depth):
+        "Transposition table key of a node searched at the given ply depth."
+        return self.transpositionTable.makeKey(state, agentIndex, self.depth - depth)
+
+    def tableLookup(self, key, alpha=float("-inf"), beta=float("inf")):
+        """
+          Returns the stored value for key if it can replace a search with the
+          given window, None otherwise.
+        """
+        entry = self.transpositionTable.lookup(key)
+        if entry is None:
+            return None
+        # The stored subtree may have been cut at the depth limit
+        self.reachedDepthLimit = True
+        value, flag = entry
+        if flag == TranspositionTable.EXACT:
+            return value
+        if flag == TranspositionTable.LOWERBOUND and value > beta:
+            return value
+        if flag == TranspositionTable.UPPERBOUND and value < alpha:
+            return value
+        return None
 
 
 class MinimaxAgent(MultiAgentSearchAgent):
@@ -155,6 +535,13 @@ class MinimaxAgent(MultiAgentSearchAgent):
         if state.isWin() or state.isLose():
             return self.evaluationFunction(state)
 
+        key = None
+        if self.transpositionTable is not None and not surface:
+            key = self.tableKey(state, 0, depth)
+            stored = self.tableLookup(key)
+            if stored is not None:
+                return stored
+
         best_utility = float("-inf")
         utility_tmp = best_utility
         best_action = 0
@@ -170,6 +557,8 @@ class MinimaxAgent(MultiAgentSearchAgent):
         if surface:
             return best_action
         else:
+            if key is not None:
+                self.transpositionTable.store(key, best_utility)
             return best_utility
 
     def min_ghost(self, state, depth, ghost):
@@ -177,6 +566,13 @@ class MinimaxAgent(MultiAgentSearchAgent):
         if state.isWin() or state.isLose():
             return self.evaluationFunction(state)
 
+        key = None
+        if self.transpositionTable is not None:
+            key = self.tableKey(state, ghost, depth)
+            stored = self.tableLookup(key)
+            if stored is not None:
+                return stored
+
         if state.getNumAgents()-1 == ghost:
             # pacman is next
             next_ghost = 0
@@ -199,6 +595,8 @@ class MinimaxAgent(MultiAgentSearchAgent):
                 current_utility = self.min_ghost(state.generateSuccessor(ghost, action), depth, next_ghost)
 
             best_utility = MIN(best_utility, current_utility)
+        if key is not None:
+            self.transpositionTable.store(key, best_utility)
         return best_utility
 
 
@@ -216,18 +614,137 @@ def MIN(val1, val2):
         return val2
 
 
+# Per-process state of the root search workers of a parallel AlphaBetaAgent
+_workerAgent = None
+_workerAlpha = None
+
+def _initRootSearchWorker(agent, sharedAlpha):
+    global _workerAgent, _workerAlpha
+    _workerAgent = agent
+    _workerAlpha = sharedAlpha
+
+def _searchRootChild(task):
+    """
+      Searches one child of the root with the best alpha found so far by any
+      worker, then publishes its value.  Returns the value and whether the
+      search stopped at the depth limit anywhere, or None if the deadline
+      passed.
+    """
+    childState, depth, deadline = task
+    _workerAgent.depth = depth
+    _workerAgent.deadline = deadline
+    _workerAgent.reachedDepthLimit = False
+    try:
+        utility = _workerAgent.min_ghost_alpha_beta(childState, 0, 1, _workerAlpha.value, float("inf"))
+    except SearchTimeout:
+        return None
+    with _workerAlpha.get_lock():
+        if utility > _workerAlpha.value:
+            _workerAlpha.value = utility
+    return utility, _workerAgent.reachedDepthLimit
+
+
 class AlphaBetaAgent(MultiAgentSearchAgent):
     """
       Your minimax agent with alpha-beta pruning (question 3)
+
+      With numProcesses > 1 the children of the root are searched by a pool of
+      worker processes sharing the best alpha found so far.  The eldest child
+      is searched first, in this process, to give the workers a bound.  For a
+      deterministic evaluation function the chosen action is the same as the
+      one of the serial search.
+
+      Passing moveOrdering=True (or some of killers, history and static
+      joined with '+', e.g. moveOrdering=killers+history) orders the moves with a MoveOrdering,
+      whose counters are printed at the end of each game.
     """
 
+    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', numProcesses = '1', moveOrdering = 'False', **args):
+        MultiAgentSearchAgent.__init__(self, evalFn, depth, **args)
+        self.numProcesses = int(numProcesses)
+        self.pool = None
+        self.sharedAlpha = None
+        self.moveOrdering = None
+        if parseBoolArg(moveOrdering):
+            self.moveOrdering = MoveOrdering()
+        elif str(moveOrdering).lower() not in ['false', '0', 'no', '']:
+            self.moveOrdering = MoveOrdering(tuple(str(moveOrdering).split('+')))
+
+    def __getstate__(self):
+        # Worker pools cannot be pickled; a copy starts its own when needed
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['sharedAlpha'] = None
+        return state
+
     def getAction(self, gameState):
         """
           Returns the minimax action using self.depth and self.evaluationFunction
         """
-
+        if self.iterativeDeepening:
+            return self.iterativeDeepeningAction(gameState)
+        return self.searchRoot(gameState)
+
+    def searchRoot(self, gameState):
+        if self.moveOrdering is not None:
+            self.moveOrdering.newSearch()
+        if self.numProcesses > 1:
+            return self.parallelSearchRoot(gameState)
         return self.max_pacman_alpha_beta(gameState, 0, True, float("-inf"), float("inf"))
 
+    def orderActions(self, moveKey, actions, state=None, agentIndex=0, depth=0):
+        "Applies the move ordering heuristics, then moves the best action of the previous iteration to the front."
+        if self.moveOrdering is not None and state is not None:
+            actions = self.moveOrdering.order(state, agentIndex, depth, actions)
+        return MultiAgentSearchAgent.orderActions(self, moveKey, actions)
+
+    def recordCutoff(self, state, agentIndex, depth, action, moveNumber):
+        if self.moveOrdering is not None:
+            self.moveOrdering.recordCutoff(state, agentIndex, depth, action, moveNumber, self.depth - depth)
+
+    def parallelSearchRoot(self, gameState):
+        """
+          Same as max_pacman_alpha_beta at the root, with the younger children
+          searched in parallel once the eldest one has been searched.
+        """
+        move_key = self.bestMoveKey(gameState, 0)
+        possible_actions = self.orderActions(move_key, gameState.getLegalActions(0), gameState, 0, 0)
+        if len(possible_actions) < 2:
+            return self.max_pacman_alpha_beta(gameState, 0, True, float("-inf"), float("inf"))
+        if self.pool is None:
+            self.sharedAlpha = multiprocessing.Value('d', float("-inf"))
+            self.pool = multiprocessing.Pool(self.numProcesses, _initRootSearchWorker, (self, self.sharedAlpha))
+
+        best_action = possible_actions[0]
+        best_utility = self.min_ghost_alpha_beta(gameState.generateSuccessor(0, best_action), 0, 1, float("-inf"), float("inf"))
+        self.sharedAlpha.value = best_utility
+
+        tasks = [(gameState.generateSuccessor(0, action), self.depth, self.deadline) for action in possible_actions[1:]]
+        results = self.pool.map(_searchRootChild, tasks, 1)
+        if None in results:
+            raise SearchTimeout()
+        for action, (utility_tmp, reachedDepthLimit) in zip(possible_actions[1:], results):
+            # The workers' searches only set the flag in their own process
+            self.reachedDepthLimit = self.reachedDepthLimit or reachedDepthLimit
+            if utility_tmp > best_utility:
+                best_utility = utility_tmp
+                best_action = action
+        self.recordBestAction(move_key, best_action)
+        return best_action
+
+    def closePool(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.sharedAlpha = None
+
+    def final(self, state):
+        "Called by the Game when it ends: stops the worker processes."
+        self.closePool()
+        if self.moveOrdering is not None:
+            print self.moveOrdering
+
     def max_pacman_alpha_beta(self, state, depth, surface, alpha, beta):
         #if surface:
             #print("\n\n-----------------------------------------\n")
@@ -235,27 +752,49 @@ class AlphaBetaAgent(MultiAgentSearchAgent):
 
         if state.isWin() or state.isLose():
             return self.evaluationFunction(state)
+        self.checkDeadline()
+
+        key = None
+        if self.transpositionTable is not None and not surface:
+            key = self.tableKey(state, 0, depth)
+            stored = self.tableLookup(key, alpha, beta)
+            if stored is not None:
+                return stored
+        alpha_orig = alpha
 
         best_utility = float("-inf")
         utility_tmp = best_utility
         best_action = 0
 
-        possible_actions = state.getLegalActions(0)
+        if self.moveOrdering is not None:
+            self.moveOrdering.recordNode()
+        move_key = self.bestMoveKey(state, 0)
+        possible_actions = self.orderActions(move_key, state.getLegalActions(0), state, 0, depth)
         #print(possible_actions)
 
-        for action in possible_actions:
+        for move_number, action in enumerate(possible_actions):
             utility_tmp = self.min_ghost_alpha_beta(state.generateSuccessor(0, action), depth, 1, alpha, beta)
             if utility_tmp > best_utility:
                 best_utility = utility_tmp
                 best_action = action
             if best_utility > beta:
                 #print("\n\nReturning action: " + best_action + " - utility: " + str(best_utility))
+                self.recordCutoff(state, 0, depth, action, move_number)
+                self.recordBestAction(move_key, best_action)
+                if key is not None:
+                    self.transpositionTable.store(key, best_utility, TranspositionTable.LOWERBOUND)
                 return best_utility
             alpha = MAX(alpha, best_utility)
+        self.recordBestAction(move_key, best_action)
         if surface:
             #print("\n\nReturning action: " + best_action + " - utility: " + str(best_utility))
             return best_action
         else:
+            if key is not None:
+                if best_utility <= alpha_orig:
+                    self.transpositionTable.store(key, best_utility, TranspositionTable.UPPERBOUND)
+                else:
+                    self.transpositionTable.store(key, best_utility, TranspositionTable.EXACT)
             return best_utility
 
     def min_ghost_alpha_beta(self, state, depth, ghost, alpha, beta):
@@ -264,6 +803,15 @@ class AlphaBetaAgent(MultiAgentSearchAgent):
 
         if state.isWin() or state.isLose():
             return self.evaluationFunction(state)
+        self.checkDeadline()
+
+        key = None
+        if self.transpositionTable is not None:
+            key = self.tableKey(state, ghost, depth)
+            stored = self.tableLookup(key, alpha, beta)
+            if stored is not None:
+                return stored
+        beta_orig = beta
 
         if state.getNumAgents()-1 == ghost:
             # pacman is next
@@ -273,22 +821,39 @@ class AlphaBetaAgent(MultiAgentSearchAgent):
 
         best_utility = float("inf")
         current_utility = best_utility
+        best_action = None
 
-        possible_actions = state.getLegalActions(ghost)
+        if self.moveOrdering is not None:
+            self.moveOrdering.recordNode()
+        move_key = self.bestMoveKey(state, ghost)
+        possible_actions = self.orderActions(move_key, state.getLegalActions(ghost), state, ghost, depth)
         #print(possible_actions)
 
-        for action in possible_actions:
+        for move_number, action in enumerate(possible_actions):
             if next_ghost == 0:
                 if depth != self.depth-1:
                     current_utility = self.max_pacman_alpha_beta(state.generateSuccessor(ghost, action), depth+1, False, alpha, beta)
                 else:
+                    self.reachedDepthLimit = True
                     current_utility = self.evaluationFunction(state.generateSuccessor(ghost, action))
             else:
                 current_utility = self.min_ghost_alpha_beta(state.generateSuccessor(ghost, action), depth, next_ghost, alpha, beta)
+            if current_utility < best_utility:
+                best_action = action
             best_utility = MIN(best_utility, current_utility)
             if best_utility < alpha:
+                self.recordCutoff(state, ghost, depth, action, move_number)
+                self.recordBestAction(move_key, best_action)
+                if key is not None:
+                    self.transpositionTable.store(key, best_utility, TranspositionTable.UPPERBOUND)
                 return best_utility
             beta = MIN(beta, best_utility)
+        self.recordBestAction(move_key, best_action)
+        if key is not None:
+            if best_utility >= beta_orig:
+                self.transpositionTable.store(key, best_utility, TranspositionTable.LOWERBOUND)
+            else:
+                self.transpositionTable.store(key, best_utility, TranspositionTable.EXACT)
         return best_utility
 
 
@@ -300,27 +865,47 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
     def max_pacman_expectimax(self, state, depth, surface):
         if state.isWin() or state.isLose():
             return self.evaluationFunction(state)
+        self.checkDeadline()
+
+        key = None
+        if self.transpositionTable is not None and not surface:
+            key = self.tableKey(state, 0, depth)
+            stored = self.tableLookup(key)
+            if stored is not None:
+                return stored
 
         best_utility = float("-inf")
         utility_tmp = best_utility
         best_action = 0
 
-        possible_actions = state.getLegalActions(0)
+        move_key = self.bestMoveKey(state, 0)
+        possible_actions = self.orderActions(move_key, state.getLegalActions(0))
 
         for action in possible_actions:
             utility_tmp = self.min_ghost_expectimax(state.generateSuccessor(0, action), depth, 1)
             if utility_tmp > best_utility:
                 best_utility = utility_tmp
                 best_action = action
+        self.recordBestAction(move_key, best_action)
 
         if surface:
             return best_action
         else:
+            if key is not None:
+                self.transpositionTable.store(key, best_utility)
             return best_utility
 
     def min_ghost_expectimax(self, state, depth, ghost):
         if state.isWin() or state.isLose():
             return self.evaluationFunction(state)
+        self.checkDeadline()
+
+        key = None
+        if self.transpositionTable is not None:
+            key = self.tableKey(state, ghost, depth)
+            stored = self.tableLookup(key)
+            if stored is not None:
+                return stored
 
         if state.getNumAgents()-1 == ghost:
             # pacman is next
@@ -340,11 +925,15 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
                 if depth != self.depth-1:
                     current_utility = current_utility + self.max_pacman_expectimax(state.generateSuccessor(ghost, action), depth+1, False)
                 else:
+                    self.reachedDepthLimit = True
                     current_utility = current_utility + self.evaluationFunction(state.generateSuccessor(ghost, action))
             else:
                 current_utility = current_utility + self.min_ghost_expectimax(state.generateSuccessor(ghost, action), depth, next_ghost)
 
-        return current_utility / float(nb_possible_actions)
+        expected_utility = current_utility / float(nb_possible_actions)
+        if key is not None:
+            self.transpositionTable.store(key, expected_utility)
+        return expected_utility
 
     def getAction(self, gameState):
         """
@@ -359,9 +948,242 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
           All ghosts should be modeled as choosing uniformly at random from their
           legal moves.
         """
+        if self.iterativeDeepening:
+            return self.iterativeDeepeningAction(gameState)
+        return self.searchRoot(gameState)
 
+    def searchRoot(self, gameState):
         return self.max_pacman_expectimax(gameState, 0, True)
 
+class MCTSNode(object):
+    """
+      A node of the open-loop search tree of MCTSAgent.  It stands for a
+      sequence of Pacman actions from the root, whatever the ghosts did in
+      between: Pacman's moves are deterministic, so every state reached
+      through a node has the same Pacman position and legal actions.
+    """
+    __slots__ = ('position', 'untriedActions', 'children', 'visits', 'totalValue')
+
+    def __init__(self, position):
+        self.position = position
+        self.untriedActions = None # Set on the first visit to a non-terminal state
+        self.children = {}
+        self.visits = 0
+        self.totalValue = 0.0
+
+    def size(self):
+        "Number of nodes in the subtree rooted here."
+        size = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            size += 1
+            stack.extend(node.children.values())
+        return size
+
+class MCTSAgent(MultiAgentSearchAgent):
+    """
+      A Monte Carlo tree search (UCT) agent.  Each iteration walks down the
+      tree choosing Pacman's actions with UCB1, adds one node, then plays a
+      rollout of at most rolloutDepth turns and backs up its value: the final
+      score, or the evaluation function if the rollout was cut short.
+
+      Ghosts are modelled by rolloutGhosts, directional (the distribution of
+      DirectionalGhost) or random, both in the tree and in rollouts; Pacman's
+      rollout policy picks uniformly among its moves other than stopping and
+      turning back.
+
+      Each move runs the given number of iterations if iterations > 0, and
+      otherwise as many as fit in the move budget (at most timeBudget, see
+      MultiAgentSearchAgent.getMoveBudget).  With reuseTree=True the subtree
+      of the action played is kept for the next move.  verbose=True prints
+      the statistics of every move, and their averages at the end of each
+      game.
+    """
+
+    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', iterations = '0', exploration = '1.0',
+                 rolloutDepth = '20', rolloutGhosts = 'directional', reuseTree = 'True', verbose = 'False',
+                 timeBudget = '0.5', **args):
+        MultiAgentSearchAgent.__init__(self, evalFn, depth, timeBudget = timeBudget, **args)
+        self.iterations = int(iterations)
+        self.exploration = float(exploration)
+        self.rolloutDepth = int(rolloutDepth)
+        if rolloutGhosts not in ('directional', 'random'):
+            raise Exception('rolloutGhosts must be directional or random, not %s' % rolloutGhosts)
+        self.rolloutGhosts = rolloutGhosts
+        self.reuseTree = parseBoolArg(reuseTree)
+        self.verbose = parseBoolArg(verbose)
+        self.root = None
+        self.treeSize = 0
+        self.valueRange = None
+        self.lastStats = None
+        self.moveStats = []
+
+    def registerInitialState(self, gameState):
+        self.root = None
+        self.moveStats = []
+
+    def getAction(self, gameState):
+        """
+          Returns the most visited action of the root after the search.
+        """
+        startTime = time.time()
+        self.newRoot(gameState)
+        reusedVisits = self.root.visits
+
+        deadline = startTime + self.getMoveBudget(gameState)
+        iterations = 0
+        while True:
+            self.runIteration(gameState)
+            iterations += 1
+            if self.iterations > 0:
+                if iterations >= self.iterations: break
+            elif time.time() > deadline:
+                break
+
+        children = self.root.children
+        action = max(children.keys(), key = lambda a: (children[a].visits, children[a].totalValue / children[a].visits))
+        self.recordMoveTime(startTime)
+        elapsed = time.time() - startTime
+        self.lastStats = {'iterations': iterations, 'reusedVisits': reusedVisits, 'treeSize': self.treeSize,
+                          'time': elapsed, 'rolloutsPerSecond': iterations / max(elapsed, 1e-6)}
+        self.moveStats.append(self.lastStats)
+        if self.verbose:
+            print 'MCTS: %d iterations (%d reused), tree of %d nodes, %.0f rollouts/s, %s' % (
+                iterations, reusedVisits, self.treeSize, self.lastStats['rolloutsPerSecond'], action)
+
+        if self.reuseTree:
+            self.root = children[action]
+        else:
+            self.root = None
+        return action
+
+    def newRoot(self, gameState):
+        """
+          Makes self.root the node of gameState: the subtree kept from the
+          previous move if Pacman is where it expected, otherwise a new node.
+        """
+        if self.root is not None and self.root.position == gameState.getPacmanPosition():
+            self.treeSize = self.root.size()
+        else:
+            self.root = MCTSNode(gameState.getPacmanPosition())
+            self.treeSize = 1
+            self.valueRange = None
+
+    def runIteration(self, rootState):
+        "One selection, expansion, rollout and backup from the root."
+        node = self.root
+        state = rootState
+        path = [node]
+        while not (state.isWin() or state.isLose()):
+            if node.untriedActions is None:
+                node.untriedActions = state.getLegalActions(0)
+            if node.untriedActions:
+                action = node.untriedActions.pop(random.randrange(len(node.untriedActions)))
+                state = self.playTurn(state, action)
+                node.children[action] = MCTSNode(state.getPacmanPosition())
+                self.treeSize += 1
+                path.append(node.children[action])
+                break
+            action = self.selectAction(node)
+            state = self.playTurn(state, action)
+            node = node.children[action]
+            path.append(node)
+
+        value = self.rollout(state)
+        if self.valueRange is None:
+            self.valueRange = [value, value]
+        else:
+            self.valueRange[0] = min(self.valueRange[0], value)
+            self.valueRange[1] = max(self.valueRange[1], value)
+        for node in path:
+            node.visits += 1
+            node.totalValue += value
+
+    def selectAction(self, node):
+        "The UCB1 choice among the children of a fully expanded node, with values scaled to [0, 1]."
+        low, high = self.valueRange
+        scale = (high - low) or 1.0
+        logVisits = math.log(node.visits)
+        bestAction = None
+        bestBound = float("-inf")
+        for action, child in node.children.items():
+            bound = (child.totalValue / child.visits - low) / scale + \
+                    self.exploration * math.sqrt(logVisits / child.visits)
+            if bound > bestBound:
+                bestBound = bound
+                bestAction = action
+        return bestAction
+
+    def playTurn(self, state, action):
+        "Pacman plays action, then every ghost plays a move drawn from the ghost model."
+        if self.rolloutGhosts == 'directional':
+            ghostAction = self.directionalGhostAction
+        else:
+            ghostAction = self.randomGhostAction
+        state = state.generateSuccessor(0, action)
+        for ghostIndex in range(1, state.getNumAgents()):
+            if state.isWin() or state.isLose(): break
+            state = state.generateSuccessor(ghostIndex, ghostAction(state, ghostIndex))
+        return state
+
+    def randomGhostAction(self, state, ghostIndex):
+        return random.choice(state.getLegalActions(ghostIndex))
+
+    def directionalGhostAction(self, state, ghostIndex):
+        """
+          Samples the move of a DirectionalGhost without building its
+          distribution: with probability 0.8 one of the moves towards Pacman
+          (away from it when scared), otherwise any legal move.
+        """
+        actions = state.getLegalActions(ghostIndex)
+        if random.random() >= 0.8:
+            return random.choice(actions)
+        ghostState = state.data.agentStates[ghostIndex]
+        x, y = ghostState.configuration.pos
+        px, py = state.data.agentStates[0].configuration.pos
+        isScared = ghostState.scaredTimer > 0
+        speed = 1
+        if isScared: speed = 0.5
+        distances = []
+        for action in actions:
+            dx, dy = Actions._directions[action]
+            distances.append(abs(x + dx * speed - px) + abs(y + dy * speed - py))
+        if isScared:
+            bestDistance = max(distances)
+        else:
+            bestDistance = min(distances)
+        bestActions = [action for action, distance in zip(actions, distances) if distance == bestDistance]
+        return random.choice(bestActions)
+
+    def rolloutAction(self, state):
+        actions = state.getLegalActions(0)
+        if len(actions) > 1 and Directions.STOP in actions:
+            actions.remove(Directions.STOP)
+        if len(actions) > 1:
+            reverse = Directions.REVERSE[state.getPacmanState().configuration.direction]
+            if reverse in actions:
+                actions.remove(reverse)
+        return random.choice(actions)
+
+    def rollout(self, state):
+        for turn in range(self.rolloutDepth):
+            if state.isWin() or state.isLose(): break
+            state = self.playTurn(state, self.rolloutAction(state))
+        if state.isWin() or state.isLose():
+            return state.getScore()
+        return self.evaluationFunction(state)
+
+    def final(self, state):
+        "Called by the Game when it ends: prints the average statistics of the moves if verbose."
+        if self.verbose and self.moveStats:
+            numMoves = float(len(self.moveStats))
+            print 'MCTS: %d moves, %.0f iterations per move, %.0f nodes per tree, %.0f rollouts/s' % (
+                numMoves, sum([s['iterations'] for s in self.moveStats]) / numMoves,
+                sum([s['treeSize'] for s in self.moveStats]) / numMoves,
+                sum([s['rolloutsPerSecond'] for s in self.moveStats]) / numMoves)
+        self.root = None
+
 def betterEvaluationFunction(currentGameState):
     """
       Your extreme ghost-hunting, pellet-nabbing, food-gobbling, unstoppable
@@ -370,9 +1192,25 @@ def betterEvaluationFunction(currentGameState):
       DESCRIPTION: <write something here so we know what you did>
     """
     "*** YOUR CODE HERE ***"
+    return betterEvaluation(currentGameState, lambda: random.randint(1,3))
+
+def deterministicBetterEvaluationFunction(currentGameState):
+    """
+      betterEvaluationFunction with its tie-breaking noise drawn from the
+      hash of the state instead of the random module: the same state always
+      gets the same value, so it can be cached (evalCache, transposition
+      tables) and searched in parallel with reproducible decisions.
+    """
+    return betterEvaluation(currentGameState, lambda: 1 + hash(searchStateKey(currentGameState)) % 3)
+
+def betterEvaluation(currentGameState, noise):
+    """
+      The evaluation of betterEvaluationFunction, with noise() returning the
+      noise (between 1 and 3) to add to non-terminal states.
+    """
     # Useful information you can extract from a GameState (pacman.py)
     pos = currentGameState.getPacmanPosition()
-    food = currentGameState.getFood()
+    foodPositions = currentGameState.getFoodPositions()
     ghostStates = currentGameState.getGhostStates()
     scaredTimes = [ghostState.scaredTimer for ghostState in ghostStates]
 
@@ -386,15 +1224,16 @@ def betterEvaluationFunction(currentGameState):
     if currentGameState.isWin():
         return float("inf")
     
-    numberOfFoodLeft = len(food.asList())
+    numberOfFoodLeft = len(foodPositions)
     averageDistanceTofood = 0
     hasFood = False
-    if pos in food.asList():
+    if pos in foodPositions:
         hasFood = True
     #The distance to the closest food is substracted to the score
-    if len(food.asList()) != 0:
-        distanceToClosestFood = min([manhattanDistance(pos, foodPosition) for foodPosition in food.asList()])
-        averageDistanceTofood = sum([manhattanDistance(pos, foodPosition) for foodPosition in food.asList()]) / float(len(food.asList()))
+    if numberOfFoodLeft != 0:
+        foodDistances = [manhattanDistance(pos, foodPosition) for foodPosition in foodPositions]
+        distanceToClosestFood = min(foodDistances)
+        averageDistanceTofood = sum(foodDistances) / float(numberOfFoodLeft)
     
 
     numberOfDangerousGhosts = 0
@@ -411,15 +1250,16 @@ def betterEvaluationFunction(currentGameState):
             else:
                 score = distancesToDangerousGhosts[0] 
 
-    score -= distanceToClosestFood*3 - averageDistanceTofood + random.randint(1,3)
+    score -= distanceToClosestFood*3 - averageDistanceTofood + noise()
     if hasFood:
         score = score * 1.2 
 
 
     return score+currentGameState.getScore()
 
-# Abbreviation
+# Abbreviations
 better = betterEvaluationFunction
+deterministicBetter = deterministicBetterEvaluationFunction
 
 class ContestAgent(AlphaBetaAgent):
   """
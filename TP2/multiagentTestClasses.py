@@ -159,6 +159,8 @@ class GradingAgent(Agent):
         # keep track of elapsed moves
         self.stepCount = 0
         self.seed = seed
+        # the number of states explored is part of the grade
+        GameState.setExploredTracking(True)
 
     def registerInitialState(self, state):
         if 'registerInitialState' in dir(self.studentAgent):
@@ -239,6 +241,7 @@ class PolyAgent(Agent):
         self.partialPlyBugLists = []
         self.seed = seed
         self.stepCount = 0
+        GameState.setExploredTracking(True)
 
     def select(self, list, indices):
         """
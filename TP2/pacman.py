@@ -40,8 +40,8 @@ To play your first game, type 'python pacman.py' from the command line.
 The keys are 'a', 's', 'd', and 'w' to move (or arrow keys).  Have fun!
 """
 from game import GameStateData
+from game import Slotted
 from game import Game
-from game import Directions
 from game import Actions
 from util import nearestPoint
 from util import manhattanDistance
@@ -52,7 +52,7 @@ import sys, types, time, random, os
 # YOUR INTERFACE TO THE PACMAN WORLD: A GameState #
 ###################################################
 
-class GameState:
+class GameState(Slotted):
     """
     A GameState specifies the full game state, including the food, capsules,
     agent configurations and score changes.
@@ -66,19 +66,27 @@ class GameState:
 
     Note that in classic Pacman, Pacman is always agent 0.
     """
+    __slots__ = ('data',)
 
     ####################################################
     # Accessor methods: use these to access state data #
     ####################################################
 
-    # static variable keeps track of which states have had getLegalActions called
+    # static variables keep track of the states generated by generateSuccessor,
+    # as the set of their hashes; the autograder turns this on, it is off otherwise
+    trackExplored = False
     explored = set()
     def getAndResetExplored():
-        tmp = GameState.explored.copy()
+        tmp = GameState.explored
         GameState.explored = set()
         return tmp
     getAndResetExplored = staticmethod(getAndResetExplored)
 
+    def setExploredTracking( enabled ):
+        GameState.trackExplored = enabled
+        GameState.explored = set()
+    setExploredTracking = staticmethod(setExploredTracking)
+
     def getLegalActions( self, agentIndex=0 ):
         """
         Returns the legal actions for the agent specified.
@@ -112,7 +120,7 @@ class GameState:
         if agentIndex == 0:
             state.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
         else:
-            GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
+            GhostRules.decrementTimer( state.data.writableAgentState( agentIndex ) )
 
         # Resolve multi-agent effects
         GhostRules.checkDeath( state, agentIndex )
@@ -120,8 +128,10 @@ class GameState:
         # Book keeping
         state.data._agentMoved = agentIndex
         state.data.score += state.data.scoreChange
-        GameState.explored.add(self)
-        GameState.explored.add(state)
+        state.data.updateHash( self.data )
+        if GameState.trackExplored:
+            GameState.explored.add( hash( self.data ) )
+            GameState.explored.add( hash( state.data ) )
         return state
 
     def getLegalPacmanActions( self ):
@@ -174,7 +184,14 @@ class GameState:
         return self.data.capsules
 
     def getNumFood( self ):
-        return self.data.food.count()
+        return self.data._numFood
+
+    def getFoodPositions( self ):
+        """
+        Returns a frozenset of the (x,y) positions of the remaining food.
+        Cheaper than getFood().asList() when only the positions are needed.
+        """
+        return self.data._foodPositions
 
     def getFood(self):
         """
@@ -331,7 +348,7 @@ class PacmanRules:
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions( state.getPacmanState().configuration, state.data.layout.walls )
+        return state.data.layout.getAdjacency().getPossibleActions( state.data.agentStates[0].configuration )
     getLegalActions = staticmethod( getLegalActions )
 
     def applyAction( state, action ):
@@ -342,7 +359,7 @@ class PacmanRules:
         if action not in legal:
             raise Exception("Illegal action " + str(action))
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.writableAgentState( 0 )
 
         # Update Configuration
         vector = Actions.directionToVector( action, PacmanRules.PACMAN_SPEED )
@@ -361,21 +378,19 @@ class PacmanRules:
         # Eat food
         if state.data.food[x][y]:
             state.data.scoreChange += 10
-            state.data.food = state.data.food.copy()
-            state.data.food[x][y] = False
+            state.data.removeFood( position )
             state.data._foodEaten = position
-            # TODO: cache numFood?
             numFood = state.getNumFood()
             if numFood == 0 and not state.data._lose:
                 state.data.scoreChange += 500
                 state.data._win = True
         # Eat capsule
         if( position in state.getCapsules() ):
-            state.data.capsules.remove( position )
+            state.data.capsules = [capsule for capsule in state.data.capsules if capsule != position]
             state.data._capsuleEaten = position
             # Reset all ghosts' scared timers
             for index in range( 1, len( state.data.agentStates ) ):
-                state.data.agentStates[index].scaredTimer = SCARED_TIME
+                state.data.writableAgentState( index ).scaredTimer = SCARED_TIME
     consume = staticmethod( consume )
 
 class GhostRules:
@@ -389,13 +404,7 @@ class GhostRules:
         reach a dead end, but can turn 90 degrees at intersections.
         """
         conf = state.getGhostState( ghostIndex ).configuration
-        possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
-        reverse = Actions.reverseDirection( conf.direction )
-        if Directions.STOP in possibleActions:
-            possibleActions.remove( Directions.STOP )
-        if reverse in possibleActions and len( possibleActions ) > 1:
-            possibleActions.remove( reverse )
-        return possibleActions
+        return state.data.layout.getAdjacency().getGhostActions( conf )
     getLegalActions = staticmethod( getLegalActions )
 
     def applyAction( state, action, ghostIndex):
@@ -404,7 +413,7 @@ class GhostRules:
         if action not in legal:
             raise Exception("Illegal ghost action " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.writableAgentState( ghostIndex )
         speed = GhostRules.GHOST_SPEED
         if ghostState.scaredTimer > 0: speed /= 2.0
         vector = Actions.directionToVector( action, speed )
@@ -436,9 +445,11 @@ class GhostRules:
     def collide( state, ghostState, agentIndex):
         if ghostState.scaredTimer > 0:
             state.data.scoreChange += 200
+            ghostState = state.data.writableAgentState( agentIndex )
             GhostRules.placeGhost(state, ghostState)
             ghostState.scaredTimer = 0
             # Added for first-person
+            state.data._eaten = state.data._eaten[:]
             state.data._eaten[agentIndex] = True
         else:
             if not state.data._win:
@@ -523,6 +534,10 @@ def readCommand( argv ):
                       help='Turns on exception handling and timeouts during games', default=False)
     parser.add_option('--timeout', dest='timeout', type='int',
                       help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
+    parser.add_option('-j', '--numJobs', dest='numJobs', type='int',
+                      help=default('Number of worker processes playing games in parallel, without graphics'), default=1)
+    parser.add_option('--simulate', action='store_true', dest='simulate',
+                      help='Play the games with the lean headless loop of simulateGame: no graphics, timeouts or copies of the state', default=False)
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
@@ -532,6 +547,15 @@ def readCommand( argv ):
     # Fix the random seed
     if options.fixRandomSeed: random.seed('cs188')
 
+    # Simulated games neither record, catch exceptions nor run in parallel
+    if options.simulate:
+        if options.record: raise Exception('Simulated games (--simulate) cannot be recorded (-r)')
+        if options.catchExceptions: raise Exception('Simulated games (--simulate) do not catch exceptions (-c)')
+        if options.numJobs > 1: raise Exception('Simulated games (--simulate) are not played in parallel (-j)')
+
+    # Parallel and simulated games are played without graphics
+    if options.numJobs > 1 or options.simulate: options.quietGraphics = True
+
     # Choose a layout
     args['layout'] = layout.getLayout( options.layout )
     if args['layout'] == None: raise Exception("The layout " + options.layout + " cannot be found")
@@ -540,6 +564,12 @@ def readCommand( argv ):
     noKeyboard = options.gameToReplay == None and (options.textGraphics or options.quietGraphics)
     pacmanType = loadAgent(options.pacman, noKeyboard)
     agentOpts = parseAgentArgs(options.agentArgs)
+    # Parallel games are played by daemonic worker processes, each with its own copy of the agent
+    if options.numJobs > 1:
+        if options.numTraining > 0:
+            raise Exception('Training games (-x) cannot be played in parallel (-j): every game gets a fresh copy of the agent')
+        if int(agentOpts.get('numProcesses', 1)) > 1:
+            raise Exception('Agents with numProcesses > 1 cannot play parallel games (-j): worker processes cannot start processes of their own')
     if options.numTraining > 0:
         args['numTraining'] = options.numTraining
         if 'numTraining' not in agentOpts: agentOpts['numTraining'] = options.numTraining
@@ -570,6 +600,8 @@ def readCommand( argv ):
     args['record'] = options.record
     args['catchExceptions'] = options.catchExceptions
     args['timeout'] = options.timeout
+    args['numJobs'] = options.numJobs
+    args['simulate'] = options.simulate
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
@@ -625,7 +657,141 @@ def replayGame( layout, actions, display ):
 
     display.finish()
 
-def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30 ):
+def printSummary( scores, wins ):
+    winRate = wins.count(True)/ float(len(wins))
+    print 'Average Score:', sum(scores) / float(len(scores))
+    print 'Scores:       ', ', '.join([str(score) for score in scores])
+    print 'Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate)
+    print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins])
+
+def recordGame( layout, moveHistory, gameNumber ):
+    import time, cPickle
+    fname = ('recorded-game-%d' % gameNumber) +  '-'.join([str(t) for t in time.localtime()[1:6]])
+    f = file(fname, 'w')
+    components = {'layout': layout, 'actions': moveHistory}
+    cPickle.dump(components, f)
+    f.close()
+
+def runBatchGame( task ):
+    """
+    Plays a single headless game in a worker process of runGamesParallel and
+    returns a summary record of it.
+    """
+    import textDisplay, __main__
+    gameNumber, layout, pacman, ghosts, seed, catchExceptions, timeout, record = task
+    display = textDisplay.NullGraphics()
+    __main__.__dict__['_display'] = display
+    random.seed(seed)
+    rules = ClassicGameRules(timeout)
+    startTime = time.time()
+    game = rules.newGame( layout, pacman, ghosts, display, True, catchExceptions)
+    game.run()
+    result = {'game': gameNumber, 'seed': seed, 'score': game.state.getScore(), 'win': game.state.isWin(),
+              'moves': len(game.moveHistory), 'time': time.time() - startTime,
+              'timeout': game.agentTimeout, 'crashed': game.agentCrashed}
+    if record: result['moveHistory'] = game.moveHistory
+    return result
+
+def runGamesParallel( layout, pacman, ghosts, numGames, record, numTraining = 0, catchExceptions=False, timeout=30, numJobs=2 ):
+    """
+    Plays numGames headless games spread over numJobs worker processes.  Each
+    game gets its own seed drawn from the current random state, so a fixed
+    seed (-f) reproduces the same games whatever the number of workers.
+    Agents are pickled into the workers: every game starts from a fresh copy.
+
+    Returns one result record (a dict) per game.
+    """
+    import multiprocessing
+    seeds = [random.randint(0, sys.maxint) for i in range( numGames )]
+    tasks = [(i, layout, pacman, ghosts, seeds[i], catchExceptions, timeout, record) for i in range( numGames )]
+    startTime = time.time()
+    pool = multiprocessing.Pool( numJobs )
+    results = []
+    try:
+        for result in pool.imap( runBatchGame, tasks, 1 ):
+            results.append( result )
+            if result['game'] >= numTraining:
+                print 'Game %d: %s, score %d, %d moves, %.2fs' % (result['game'] + 1, ['Loss', 'Win'][int(result['win'])],
+                                                                 result['score'], result['moves'], result['time'])
+            if record:
+                recordGame( layout, result.pop('moveHistory'), result['game'] + 1 )
+    finally:
+        pool.terminate()
+        pool.join()
+
+    scored = results[numTraining:]
+    if len(scored) > 0:
+        printSummary( [result['score'] for result in scored], [result['win'] for result in scored] )
+        print 'Game times:   ', ', '.join(['%.2f' % result['time'] for result in scored])
+        print 'Total time:    %.2fs with %d workers' % (time.time() - startTime, numJobs)
+    return results
+
+def simulateGame( layout, pacman, ghosts, maxMoves = None, timeout = 30 ):
+    """
+    Plays one game under the ClassicGameRules with a lean loop meant for bulk
+    rollouts and policy evaluation.  Unlike Game.run there is no display, no
+    output muting and no timing, and agents are given the game state itself
+    rather than a copy: only use it with trusted agents that do not modify
+    the states they see.  Agents with a setMoveTimeout method are still told
+    the time limits of ClassicGameRules(timeout), as Game.run does, so that
+    anytime agents size their moves the same way.
+
+    The game is cut short after maxMoves agent moves if given.  Returns a
+    result record (a dict) like runBatchGame; 'finished' is False for a game
+    that was cut short.
+    """
+    agents = [pacman] + ghosts[:layout.getNumGhosts()]
+    rules = ClassicGameRules( timeout )
+    state = GameState()
+    state.initialize( layout, len(ghosts) )
+    startTime = time.time()
+    for i, agent in enumerate( agents ):
+        if hasattr( agent, 'setMoveTimeout' ):
+            agent.setMoveTimeout( rules.getMoveWarningTime( i ), rules.getMaxTotalTime( i ) )
+        if hasattr( agent, 'registerInitialState' ):
+            agent.registerInitialState( state )
+    observers = [getattr( agent, 'observationFunction', None ) for agent in agents]
+
+    numAgents = len( agents )
+    agentIndex = 0
+    moves = 0
+    while not ( state.isWin() or state.isLose() ):
+        if maxMoves != None and moves >= maxMoves: break
+        observe = observers[agentIndex]
+        if observe == None:
+            action = agents[agentIndex].getAction( state )
+        else:
+            action = agents[agentIndex].getAction( observe( state ) )
+        state = state.generateSuccessor( agentIndex, action )
+        moves += 1
+        agentIndex = ( agentIndex + 1 ) % numAgents
+
+    for agent in agents:
+        if hasattr( agent, 'final' ):
+            agent.final( state )
+    return {'score': state.getScore(), 'win': state.isWin(), 'finished': state.isWin() or state.isLose(),
+            'moves': moves, 'time': time.time() - startTime}
+
+def simulateGames( layout, pacman, ghosts, numGames, numTraining = 0, maxMoves = None, timeout = 30 ):
+    """
+    Plays numGames games with simulateGame and prints a summary of the ones
+    after the first numTraining.  Returns one result record per game.
+    """
+    startTime = time.time()
+    results = [simulateGame( layout, pacman, ghosts, maxMoves, timeout ) for i in range( numGames )]
+    scored = results[numTraining:]
+    if len(scored) > 0:
+        printSummary( [result['score'] for result in scored], [result['win'] for result in scored] )
+        elapsed = time.time() - startTime
+        print 'Total time:    %.2fs (%.0f games per minute)' % (elapsed, 60 * numGames / max(elapsed, 1e-6))
+    return results
+
+def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30, numJobs=1, simulate=False ):
+    if simulate:
+        return simulateGames( layout, pacman, ghosts, numGames, numTraining, timeout = timeout )
+    if numJobs > 1:
+        return runGamesParallel( layout, pacman, ghosts, numGames, record, numTraining, catchExceptions, timeout, numJobs )
+
     import __main__
     __main__.__dict__['_display'] = display
 
@@ -647,21 +813,12 @@ def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0
         if not beQuiet: games.append(game)
 
         if record:
-            import time, cPickle
-            fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
-            f = file(fname, 'w')
-            components = {'layout': layout, 'actions': game.moveHistory}
-            cPickle.dump(components, f)
-            f.close()
+            recordGame( layout, game.moveHistory, i + 1 )
 
     if (numGames-numTraining) > 0:
         scores = [game.state.getScore() for game in games]
         wins = [game.state.isWin() for game in games]
-        winRate = wins.count(True)/ float(len(wins))
-        print 'Average Score:', sum(scores) / float(len(scores))
-        print 'Scores:       ', ', '.join([str(score) for score in scores])
-        print 'Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate)
-        print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins])
+        printSummary( scores, wins )
 
     return games
 
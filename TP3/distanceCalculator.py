@@ -24,16 +24,25 @@ distancer.getDistance( (1,1), (10,10) )
 
 The Distancer object also serves as an example of sharing data
 safely among agents via a global dictionary (distanceMap),
-and performing asynchronous computation via threads. These
+and performing asynchronous computation via a pool of worker
+threads (DistanceService) handing out futures. These
 examples may help you in designing your own objects, but you
 shouldn't need to modify the Distancer code in order to use its
 distances.
+
+Computed distance tables are also cached on disk (see distanceCacheDir), so
+other processes playing on the same layout load them instead of
+recomputing them.
 """
 
-import threading, sys, time, random
+import threading, Queue, sys, time, random, os, mmap, struct, hashlib, ctypes, stat
+from array import array
+from collections import deque, OrderedDict
+
+DEFAULT_LAZY_MEMORY = 16 * 1024 * 1024 # Bytes of distance rows kept by a lazy Distancer
 
 class Distancer:
-  def __init__(self, layout, background=True, default=10000):
+  def __init__(self, layout, background=True, default=10000, lazy=False, memoryLimit=DEFAULT_LAZY_MEMORY):
     """
     Initialize with Distancer(layout).  Changing default is unnecessary.
 
@@ -41,19 +50,39 @@ class Distancer:
     as soon as they are ready.  In the meantime, it returns manhattan distance.
 
     To compute all maze distances on initialization, set background=False
+
+    For layouts too large for the full table, set lazy=True: the distances
+    from a cell are then computed on its first query and kept in a cache of
+    at most memoryLimit bytes (see getCacheStats).
     """
     self._distances = None
     self.default = default
 
-    # Start computing distances in the background; when the dc finishes,
+    if lazy:
+      self._distances = LazyDistanceTable(layout, memoryLimit)
+      return
+
+    # Start computing distances in the background; when the future is done,
     # it will fill in self._distances for us.
-    dc = DistanceCalculator()
-    dc.setAttr(layout, self)
-    dc.setDaemon(True)
+    self._future = distanceService.request(layout)
     if background:
-      dc.start()
+      self._future.addDoneCallback(self._setDistances)
     else:
-      dc.run()
+      self._distances = self._future.result()
+
+  def _setDistances(self, future):
+    if future.exception() == None:
+      self._distances = future.result()
+
+  def waitForMazeDistances(self, timeout=None):
+    """
+    Blocks until the maze distances are ready (or timeout seconds have
+    passed) and returns whether they are.
+    """
+    if self._distances == None and self._future.wait(timeout):
+      # The future is done before its callbacks run: do not wait for _setDistances
+      self._setDistances(self._future)
+    return self.isReadyForMazeDistance()
 
   def getDistance(self, pos1, pos2):
     """
@@ -75,15 +104,20 @@ class Distancer:
     return bestDistance
 
   def getDistanceOnGrid(self, pos1, pos2):
-    key = (pos1, pos2)
-    if key in self._distances:
-      return self._distances[key]
-    else:
-      raise Exception("Positions not in grid: " + str(key))
+    distance = self._distances.getDistance(pos1, pos2)
+    if distance == None:
+      raise Exception("Positions not in grid: " + str((pos1, pos2)))
+    return distance
 
   def isReadyForMazeDistance(self):
     return self._distances != None
 
+  def getCacheStats(self):
+    "Hit, miss and eviction counts of a lazy Distancer, None otherwise."
+    if isinstance(self._distances, LazyDistanceTable):
+      return self._distances.getStats()
+    return None
+
 def manhattanDistance(x, y ):
   return abs( x[0] - y[0] ) + abs( x[1] - y[1] )
 
@@ -109,79 +143,359 @@ def getGrids1D(x):
 ##########################################
 
 distanceMap = {}
-distanceMapSemaphore = threading.Semaphore(1)
-distanceThread = None
+
+# Directory of the on-disk distance tables shared by every process of the
+# current user.  Set the PACMAN_DISTANCE_CACHE environment variable to move it,
+# or to an empty string to disable it.  The tables are trusted once mapped, so
+# the directory is private (mode 0700) and is ignored if anyone else can write
+# to it.
+distanceCacheDir = os.environ.get('PACMAN_DISTANCE_CACHE',
+                                  os.path.join(os.path.expanduser('~'), '.cache', 'pacman-distances'))
 
 def waitOnDistanceCalculator(t):
-  global distanceThread
-  if distanceThread != None:
+  if distanceService.isBusy():
     time.sleep(t)
 
-class DistanceCalculator(threading.Thread):
-  def setAttr(self, layout, distancer, default = 10000):
-    self.layout = layout
-    self.distancer = distancer
-    self.default = default
+class DistanceFuture:
+  """
+  The eventual distance table of a layout, as handed out by DistanceService.
+  """
+
+  def __init__(self):
+    self._event = threading.Event()
+    self._lock = threading.Lock()
+    self._callbacks = []
+    self._result = None
+    self._exception = None
+
+  def done(self):
+    return self._event.isSet()
+
+  def wait(self, timeout=None):
+    "Blocks until the table is ready (or timeout seconds have passed); returns done()."
+    self._event.wait(timeout)
+    return self.done()
+
+  def result(self, timeout=None):
+    "Waits for the table and returns it, raising the error of a failed computation."
+    if not self.wait(timeout):
+      raise Exception('Distances not ready after %s seconds' % timeout)
+    if self._exception != None:
+      raise self._exception
+    return self._result
+
+  def exception(self):
+    return self._exception
+
+  def addDoneCallback(self, callback):
+    "Calls callback(future) once done, right away if it already is."
+    self._lock.acquire()
+    try:
+      if not self.done():
+        self._callbacks.append(callback)
+        return
+    finally:
+      self._lock.release()
+    callback(self)
+
+  def _finish(self, result=None, exception=None):
+    self._lock.acquire()
+    try:
+      self._result = result
+      self._exception = exception
+      self._event.set()
+      callbacks, self._callbacks = self._callbacks, []
+    finally:
+      self._lock.release()
+    for callback in callbacks:
+      callback(self)
+
+class DistanceService:
+  """
+  Computes the distance tables of any number of layouts on a pool of daemon
+  worker threads.  Concurrent requests for the same layout share a single
+  computation (and DistanceFuture); finished tables are kept in distanceMap.
+  """
+
+  def __init__(self, numWorkers=2):
+    self.numWorkers = numWorkers
+    self.lock = threading.Lock()
+    self.pending = {}
+    self.tasks = Queue.Queue()
+    self.workers = []
+
+  def request(self, layout):
+    "Returns a DistanceFuture for the distance table of layout."
+    self.lock.acquire()
+    try:
+      if layout.walls in distanceMap:
+        future = DistanceFuture()
+        future._finish(distanceMap[layout.walls])
+        return future
+      if layout.walls not in self.pending:
+        self.pending[layout.walls] = DistanceFuture()
+        self.tasks.put(layout)
+        if len(self.workers) < self.numWorkers:
+          worker = threading.Thread(target=self._work)
+          worker.setDaemon(True)
+          worker.start()
+          self.workers.append(worker)
+      return self.pending[layout.walls]
+    finally:
+      self.lock.release()
+
+  def isBusy(self):
+    "Whether any table is still being computed."
+    return len(self.pending) > 0
+
+  def _work(self):
+    while True:
+      layout = self.tasks.get()
+      try:
+        distances = loadDistances(layout)
+        if distances == None:
+          distances = computeDistances(layout)
+          saveDistances(layout, distances)
+        print >>sys.stdout, '[Distancer]: Switching to maze distances'
+        result, exception = distances, None
+      except Exception, e:
+        result, exception = None, e
 
-  def run(self):
-    global distanceMap, distanceThread
-    distanceMapSemaphore.acquire()
+      self.lock.acquire()
+      try:
+        if exception == None:
+          distanceMap[layout.walls] = result
+        future = self.pending.pop(layout.walls)
+      finally:
+        self.lock.release()
+      future._finish(result, exception)
 
-    if self.layout.walls not in distanceMap:
-      if distanceThread != None: raise Exception('Multiple distance threads')
-      distanceThread = self
+distanceService = DistanceService()
 
-      distances = computeDistances(self.layout)
-      print >>sys.stdout, '[Distancer]: Switching to maze distances'
+class DistanceTable:
+  """
+  All-pairs maze distances stored as a dense V x V matrix of ints, indexed
+  by cell id (the position of the cell in layout.walls.asList(False)).
 
-      distanceMap[self.layout.walls] = distances
-      distanceThread = None
+  It can be queried like the dictionary keyed by (pos1, pos2) it replaces;
+  pairs of cells with no path between them are sys.maxint apart.
+  """
+
+  UNREACHABLE = -1
+
+  def __init__(self, cells, matrix):
+    self.cells = cells
+    self.cellIndex = dict([(cell, i) for i, cell in enumerate(cells)])
+    self.matrix = matrix
+
+  def getDistance(self, pos1, pos2):
+    "Returns the maze distance between two cells, or None if either is not an open cell."
+    i = self.cellIndex.get(pos1)
+    j = self.cellIndex.get(pos2)
+    if i == None or j == None:
+      return None
+    distance = self.matrix[i * len(self.cells) + j]
+    if distance == DistanceTable.UNREACHABLE:
+      return sys.maxint
+    return distance
+
+  def __contains__(self, key):
+    return key[0] in self.cellIndex and key[1] in self.cellIndex
+
+  def __getitem__(self, key):
+    distance = self.getDistance(key[0], key[1])
+    if distance == None:
+      raise KeyError(key)
+    return distance
+
+  def __len__(self):
+    return len(self.cells) ** 2
+
+class LazyDistanceTable:
+  """
+  Maze distances computed one source cell at a time, on first query, and
+  kept in a least recently used cache of at most memoryLimit bytes.  Answers
+  the same queries, with the same values, as the DistanceTable of
+  computeDistances.
+  """
+
+  def __init__(self, layout, memoryLimit=DEFAULT_LAZY_MEMORY):
+    self.cells = layout.walls.asList(False)
+    self.cellIndex = dict([(cell, i) for i, cell in enumerate(self.cells)])
+    self.neighbors = getNeighbors(self.cells, self.cellIndex)
+    rowSize = array('i').itemsize * max(len(self.cells), 1)
+    self.maxRows = max(1, memoryLimit // rowSize)
+    self.rows = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def getRow(self, source):
+    "The distances from one cell id, computed if they are not cached."
+    row = self.rows.pop(source, None)
+    if row == None:
+      self.misses += 1
+      row = computeDistanceRow(self.neighbors, source)
+      if len(self.rows) >= self.maxRows:
+        self.rows.popitem(last=False)
+        self.evictions += 1
     else:
-      distances = distanceMap[self.layout.walls]
+      self.hits += 1
+    self.rows[source] = row
+    return row
+
+  def getDistance(self, pos1, pos2):
+    "Returns the maze distance between two cells, or None if either is not an open cell."
+    i = self.cellIndex.get(pos1)
+    j = self.cellIndex.get(pos2)
+    if i == None or j == None:
+      return None
+    # Distances are symmetric: a cached row from either end will do
+    if i not in self.rows and j in self.rows:
+      i, j = j, i
+    distance = self.getRow(i)[j]
+    if distance == DistanceTable.UNREACHABLE:
+      return sys.maxint
+    return distance
 
-    distanceMapSemaphore.release()
-    self.distancer._distances = distances
+  def __contains__(self, key):
+    return key[0] in self.cellIndex and key[1] in self.cellIndex
+
+  def __getitem__(self, key):
+    distance = self.getDistance(key[0], key[1])
+    if distance == None:
+      raise KeyError(key)
+    return distance
+
+  def getStats(self):
+    return {'rows': len(self.rows), 'maxRows': self.maxRows, 'hits': self.hits,
+            'misses': self.misses, 'evictions': self.evictions}
+
+  def __str__(self):
+    lookups = self.hits + self.misses
+    hitRate = self.hits / float(lookups) if lookups > 0 else 0.0
+    return "LazyDistanceTable: %d/%d rows, %d hits, %d misses (%.2f), %d evictions" % \
+           (len(self.rows), self.maxRows, self.hits, self.misses, hitRate, self.evictions)
+
+def getNeighbors(cells, cellIndex):
+    "Returns the ids of the open cells adjacent to each open cell."
+    neighbors = []
+    for x, y in cells:
+        neighbors.append([cellIndex[other] for other in ((x,y+1), (x,y-1), (x+1,y), (x-1,y))
+                          if other in cellIndex])
+    return neighbors
+
+def computeDistanceRow(neighbors, source):
+    "Breadth first search from one cell id: the distances to every cell id."
+    row = array('i', [DistanceTable.UNREACHABLE]) * len(neighbors)
+    row[source] = 0
+    queue = deque([source])
+    while queue:
+        node = queue.popleft()
+        nodeDist = row[node] + 1
+        for other in neighbors[node]:
+            if row[other] == DistanceTable.UNREACHABLE:
+                row[other] = nodeDist
+                queue.append(other)
+    return row
 
 def computeDistances(layout):
-    distances = {}
-    allNodes = layout.walls.asList(False)
-    for source in allNodes:
-        dist = {}
-        closed = {}
-        for node in allNodes:
-            dist[node] = sys.maxint
-        import util
-        queue = util.PriorityQueue()
-        queue.push(source, 0)
-        dist[source] = 0
-        while not queue.isEmpty():
-            node = queue.pop()
-            if node in closed:
-                continue
-            closed[node] = True
-            nodeDist = dist[node]
-            adjacent = []
-            x, y = node
-            if not layout.isWall((x,y+1)):
-                adjacent.append((x,y+1))
-            if not layout.isWall((x,y-1)):
-                adjacent.append((x,y-1) )
-            if not layout.isWall((x+1,y)):
-                adjacent.append((x+1,y) )
-            if not layout.isWall((x-1,y)):
-                adjacent.append((x-1,y))
-            for other in adjacent:
-                if not other in dist:
-                    continue
-                oldDist = dist[other]
-                newDist = nodeDist+1
-                if newDist < oldDist:
-                    dist[other] = newDist
-                    queue.push(other, newDist)
-        for target in allNodes:
-            distances[(target, source)] = dist[target]
-    return distances
+    "Maze distances between every two open cells, one breadth first search per cell."
+    cells = layout.walls.asList(False)
+    cellIndex = dict([(cell, i) for i, cell in enumerate(cells)])
+    neighbors = getNeighbors(cells, cellIndex)
+    matrix = array('i')
+    for source in range(len(cells)):
+        matrix.extend(computeDistanceRow(neighbors, source))
+    return DistanceTable(cells, matrix)
+
+
+###################################
+# ON-DISK CACHE OF MAZE DISTANCES #
+###################################
+
+DISTANCE_FILE_MAGIC = 'PMDIST01'
+DISTANCE_FILE_HEADER = struct.Struct('<8si')
+
+def mapMatrix(mapping, size):
+  """
+  A typed view of the little-endian int32 distance matrix of a cache file
+  mapping, indexed like the flat array('i') built by computeDistances.
+  Reading an entry is a plain index, with no unpacking per query.
+  """
+  return (ctypes.c_int32.__ctype_le__ * size).from_buffer(mapping, DISTANCE_FILE_HEADER.size)
+
+def getDistanceCachePath(layout):
+  "The cache file for a layout, named after a hash of its walls."
+  walls = layout.walls
+  digest = hashlib.sha1('%d %d\n%s' % (walls.width, walls.height, str(walls))).hexdigest()
+  return os.path.join(distanceCacheDir, digest + '.dist')
+
+def isPrivateDirectory(path):
+  "Whether path is a directory owned by the current user that nobody else can write to."
+  try:
+    info = os.stat(path)
+  except OSError:
+    return False
+  if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+    return False
+  return stat.S_ISDIR(info.st_mode) and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def loadDistances(layout):
+  """
+  Returns the DistanceTable of a layout from the on-disk cache, or None if it
+  is not cached (or the cache is disabled or unreadable).
+  """
+  if not distanceCacheDir or not isPrivateDirectory(distanceCacheDir):
+    return None
+  cells = layout.walls.asList(False)
+  try:
+    f = open(getDistanceCachePath(layout), 'rb')
+  except IOError:
+    return None
+  try:
+    try:
+      # A copy-on-write mapping is writable, as ctypes views require, but it
+      # is never written, so its pages stay shared between processes
+      mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (mmap.error, ValueError):
+      return None
+  finally:
+    f.close()
+  if len(mapping) != DISTANCE_FILE_HEADER.size + 4 * len(cells) ** 2:
+    return None
+  magic, numCells = DISTANCE_FILE_HEADER.unpack_from(mapping)
+  if magic != DISTANCE_FILE_MAGIC or numCells != len(cells):
+    return None
+  return DistanceTable(cells, mapMatrix(mapping, len(cells) ** 2))
 
+def saveDistances(layout, distances):
+  """
+  Writes a computed DistanceTable to the on-disk cache.  The file is written
+  under a temporary name and renamed, so readers never see a partial table.
+  Failures are ignored: the cache is only an optimisation.
+  """
+  if not distanceCacheDir:
+    return
+  matrix = array('i', distances.matrix)
+  if sys.byteorder != 'little':
+    matrix.byteswap()
+  path = getDistanceCachePath(layout)
+  try:
+    if not os.path.isdir(distanceCacheDir):
+      os.makedirs(distanceCacheDir, 0700)
+    if not isPrivateDirectory(distanceCacheDir):
+      return
+    tempPath = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tempPath, 'wb')
+    try:
+      f.write(DISTANCE_FILE_HEADER.pack(DISTANCE_FILE_MAGIC, len(distances.cells)))
+      matrix.tofile(f)
+    finally:
+      f.close()
+    os.rename(tempPath, path)
+  except (IOError, OSError):
+    pass
 
 def getDistanceOnGrid(distances, pos1, pos2):
     key = (pos1, pos2)
@@ -18,6 +18,12 @@ import random
 import busters
 import game
 
+try:
+    import numpy
+    _NUMPY_ENABLED = True
+except:
+    _NUMPY_ENABLED = False
+
 class InferenceModule:
     """
     An inference module tracks a belief distribution over a ghost's location.
@@ -224,6 +230,235 @@ class ExactInference(InferenceModule):
     def getBeliefDistribution(self):
         return self.beliefs
 
+class ObservationModel:
+    """
+    Vectorised sonar model over a list of indexed positions: a precomputed
+    true-distance x noisy-reading matrix of P( noisyDistance | trueDistance ).
+    Jail positions have no likelihood, since a ghost that is observed cannot
+    be in jail.
+    """
+
+    def __init__(self, positions, jailPositions, walls):
+        self.xs = numpy.array([p[0] for p in positions])
+        self.ys = numpy.array([p[1] for p in positions])
+        self.inJail = numpy.array([p in jailPositions for p in positions], dtype=bool)
+        self.maxDistance = walls.width + walls.height
+        self.emissions = numpy.zeros((self.maxDistance + 1, self.maxDistance + busters.SONAR_MAX + 1))
+        for noisyDistance in range(self.emissions.shape[1]):
+            self.emissions[:, noisyDistance] = self.emissionColumn(noisyDistance)
+
+    def emissionColumn(self, noisyDistance):
+        "P( noisyDistance | trueDistance ) for every true distance on the board."
+        emissionModel = busters.getObservationDistribution(noisyDistance)
+        return numpy.array([emissionModel[d] for d in range(self.maxDistance + 1)])
+
+    def getLikelihoods(self, observation, pacmanPosition, indices):
+        "Returns P( observation | ghost position ) for an array of position indices."
+        pacmanX, pacmanY = pacmanPosition
+        trueDistances = numpy.abs(self.xs[indices] - pacmanX) + numpy.abs(self.ys[indices] - pacmanY)
+        if observation < self.emissions.shape[1]:
+            likelihoods = self.emissions[trueDistances, observation]
+        else:
+            likelihoods = self.emissionColumn(observation)[trueDistances]
+        likelihoods[self.inJail[indices]] = 0.0
+        return likelihoods
+
+def getSamplingTables(rows, defaults):
+    """
+    Turns rows of (successor index, probability) pairs into a successor
+    table and a cumulative probability table, padded to the widest row, so
+    that successors can be sampled for many rows at once with
+    sampleSuccessors.  An empty row keeps its default index.
+    """
+    width = max([len(row) for row in rows] + [1])
+    successorTable = numpy.zeros((len(rows), width), dtype=int)
+    cumulativeTable = numpy.ones((len(rows), width))
+    for i, row in enumerate(rows):
+        if len(row) == 0:
+            successorTable[i, :] = defaults[i]
+            continue
+        total = float(sum([prob for j, prob in row]))
+        successorTable[i, :] = row[-1][0]
+        successorTable[i, :len(row)] = [j for j, prob in row]
+        cumulativeTable[i, :len(row)] = numpy.cumsum([prob / total for j, prob in row])
+    cumulativeTable[:, -1] = 1.0
+    return successorTable, cumulativeTable
+
+def sampleSuccessors(successorTable, cumulativeTable, rows, rng):
+    "Samples one successor for each entry of rows, an array of table row indices."
+    draws = rng.random_sample(rows.shape)
+    choices = (draws[..., numpy.newaxis] >= cumulativeTable[rows]).sum(axis=-1)
+    return successorTable[rows, numpy.minimum(choices, successorTable.shape[1] - 1)]
+
+class ArrayInferenceModule(InferenceModule):
+    """
+    Shared machinery for the numpy-backed inference modules.
+
+    Positions are indexed once (the legal positions followed by the jail
+    cell).  Observations are scored from a precomputed true-distance x
+    noisy-reading emission matrix, and transitions are cached per Pacman
+    position and ghost agent type: the ghosts are removed from the observed
+    state, so the tracked ghost only reacts to Pacman.
+    """
+
+    def __init__(self, ghostAgent):
+        if not _NUMPY_ENABLED:
+            raise Exception('%s requires numpy' % self.__class__.__name__)
+        InferenceModule.__init__(self, ghostAgent)
+        self.transitions = {}
+
+    def initialize(self, gameState):
+        "Indexes the positions and builds the emission matrix, then initializes beliefs."
+        self.legalPositions = [p for p in gameState.getWalls().asList(False) if p[1] > 1]
+        self.positions = self.legalPositions + [self.getJailPosition()]
+        self.positionIndex = dict([(p, i) for i, p in enumerate(self.positions)])
+        self.jailIndex = len(self.positions) - 1
+        self.observationModel = ObservationModel(self.positions, [self.getJailPosition()], gameState.getWalls())
+        self.transitions = {}
+        self.initializeUniformly(gameState)
+
+    def getLikelihoods(self, observation, gameState, indices=None):
+        "Returns P( observation | ghost position ) for the given position indices (all by default)."
+        if indices is None: indices = numpy.arange(len(self.positions))
+        return self.observationModel.getLikelihoods(observation, gameState.getPacmanPosition(), indices)
+
+    def getTransition(self, gameState):
+        """
+        Returns the transition from the current Pacman position as a tuple of
+
+          sources, successors, probs: parallel arrays of every nonzero
+            (source index, successor index, probability) entry
+          successorTable, cumulativeTable: for every source index, its
+            successor indices and their cumulative probabilities, padded to
+            the widest row, for sampling
+
+        Successors outside the indexed positions are dropped.
+        """
+        key = (gameState.getPacmanPosition(), self.ghostAgent.__class__)
+        if key not in self.transitions:
+            rows = []
+            for oldPos in self.positions:
+                newPosDist = self.getPositionDistribution(self.setGhostPosition(gameState, oldPos))
+                rows.append([(self.positionIndex[newPos], prob) for newPos, prob in newPosDist.items()
+                             if newPos in self.positionIndex and prob > 0])
+
+            sources = [i for i, row in enumerate(rows) for entry in row]
+            successors = [j for row in rows for j, prob in row]
+            probs = [prob for row in rows for j, prob in row]
+            successorTable, cumulativeTable = getSamplingTables(rows, range(len(rows)))
+            self.transitions[key] = (numpy.array(sources, dtype=int), numpy.array(successors, dtype=int),
+                                     numpy.array(probs), successorTable, cumulativeTable)
+        return self.transitions[key]
+
+    def countsToDistribution(self, counts):
+        "Converts an array of weights over position indices into a normalized Counter."
+        beliefs = util.Counter()
+        total = float(counts.sum())
+        for i in numpy.flatnonzero(counts):
+            beliefs[self.positions[i]] = counts[i] / total
+        return beliefs
+
+class ArrayExactInference(ArrayInferenceModule):
+    """
+    Exact forward-algorithm inference over a dense numpy belief vector.  Each
+    observation is one multiplication by an emission column and each time
+    step one bincount over the cached sparse transition.
+
+    Select it with -a inference=ArrayExactInference; requires numpy.
+    """
+
+    def initializeUniformly(self, gameState):
+        "Begin with a uniform distribution over ghost positions."
+        self.beliefs = numpy.ones(len(self.positions))
+        self.beliefs[self.jailIndex] = 0.0
+        self.beliefs /= self.beliefs.sum()
+
+    def observe(self, observation, gameState):
+        "Multiplies the beliefs by the likelihood of the noisy distance at every position."
+        if observation == None:
+            self.beliefs = numpy.zeros(len(self.positions))
+            self.beliefs[self.jailIndex] = 1.0
+            return
+
+        beliefs = self.beliefs * self.getLikelihoods(observation, gameState)
+        total = beliefs.sum()
+        if total == 0:
+            self.initializeUniformly(gameState)
+        else:
+            self.beliefs = beliefs / total
+
+    def elapseTime(self, gameState):
+        "Pushes the beliefs through the transition from Pacman's current position."
+        sources, successors, probs = self.getTransition(gameState)[:3]
+        beliefs = numpy.bincount(successors, weights=self.beliefs[sources] * probs,
+                                 minlength=len(self.positions))
+        total = beliefs.sum()
+        if total > 0:
+            self.beliefs = beliefs / total
+
+    def getBeliefDistribution(self):
+        return self.countsToDistribution(self.beliefs)
+
+def systematicResample(weights, numSamples, rng):
+    """
+    Draws numSamples indices in proportion to weights with a single uniform
+    offset (systematic resampling), in O(len(weights) + numSamples).  The
+    points (k + offset) * total / numSamples are not searched for: index i
+    gets as many samples as there are points between cumulative[i - 1] and
+    cumulative[i].  The indices are returned in increasing order.
+    """
+    cumulative = numpy.cumsum(weights)
+    step = cumulative[-1] / float(numSamples)
+    # Number of points below each cumulative weight; any left over go to the last index
+    below = numpy.clip(numpy.ceil(cumulative / step - rng.random_sample()), 0, numSamples).astype(int)
+    below[-1] = numSamples
+    counts = numpy.diff(numpy.concatenate(([0], below)))
+    return numpy.repeat(numpy.arange(len(weights)), counts)
+
+class ArrayParticleFilter(ArrayInferenceModule):
+    """
+    A particle filter keeping its particles as a numpy array of position
+    indices.  Weighting is one vectorised emission lookup, resampling is
+    systematic, and the time update samples every particle's successor at
+    once from the cached transition, so tens of thousands of particles fit
+    in a move.
+
+    Select it with -a inference=ArrayParticleFilter; requires numpy.
+    """
+
+    def __init__(self, ghostAgent, numParticles=300):
+        ArrayInferenceModule.__init__(self, ghostAgent)
+        self.setNumParticles(numParticles)
+        self.rng = numpy.random.RandomState(random.randint(0, 2 ** 31 - 1))
+
+    def setNumParticles(self, numParticles):
+        self.numParticles = numParticles
+
+    def initializeUniformly(self, gameState):
+        "Spreads the particles evenly over the legal positions."
+        self.particles = numpy.arange(self.numParticles) % len(self.legalPositions)
+
+    def observe(self, observation, gameState):
+        "Weights the particles by the observation likelihood and resamples them."
+        if observation == None:
+            self.particles = numpy.empty(self.numParticles, dtype=int)
+            self.particles.fill(self.jailIndex)
+            return
+
+        weights = self.getLikelihoods(observation, gameState, self.particles)
+        if weights.sum() == 0:
+            self.initializeUniformly(gameState)
+        else:
+            self.particles = self.particles[systematicResample(weights, self.numParticles, self.rng)]
+
+    def elapseTime(self, gameState):
+        "Moves every particle to a successor sampled from the cached transition."
+        successorTable, cumulativeTable = self.getTransition(gameState)[3:]
+        self.particles = sampleSuccessors(successorTable, cumulativeTable, self.particles, self.rng)
+
+    def getBeliefDistribution(self):
+        return self.countsToDistribution(numpy.bincount(self.particles, minlength=len(self.positions)))
+
 def randomSample(counter):
     cumulativeProb = []
     i = 0
@@ -357,6 +592,33 @@ class MarginalInference(InferenceModule):
             dist[t[self.index - 1]] += prob
         return dist
 
+class ArrayMarginalInference(MarginalInference):
+    """
+    MarginalInference over the shared numpy-backed arrayJointInference.
+
+    Select it with -a inference=ArrayMarginalInference; requires numpy.
+    """
+
+    def initializeUniformly(self, gameState):
+        "Set the belief state to an initial, prior value."
+        if self.index == 1:
+            arrayJointInference.initialize(gameState, self.legalPositions)
+        arrayJointInference.addGhostAgent(self.ghostAgent)
+
+    def observeState(self, gameState):
+        "Update beliefs based on the given distance observation and gameState."
+        if self.index == 1:
+            arrayJointInference.observeState(gameState)
+
+    def elapseTime(self, gameState):
+        "Update beliefs for a time step elapsing from a gameState."
+        if self.index == 1:
+            arrayJointInference.elapseTime(gameState)
+
+    def getBeliefDistribution(self):
+        "Returns the marginal belief over a particular ghost."
+        return arrayJointInference.getMarginalDistribution(self.index - 1)
+
 class JointParticleFilter:
     """
     JointParticleFilter tracks a joint distribution over tuples of all ghost
@@ -514,8 +776,109 @@ class JointParticleFilter:
         "*** YOUR CODE HERE ***"
         util.raiseNotDefined()
 
+class ArrayJointParticleFilter(JointParticleFilter):
+    """
+    JointParticleFilter keeping the particles as an (N x numGhosts) numpy
+    array of position indices.  The time update computes each ghost's
+    transition once per distinct joint position among the particles rather
+    than once per particle, then samples all successors in bulk.
+    """
+
+    def initialize(self, gameState, legalPositions):
+        "Stores information about the game, then initializes particles."
+        if not _NUMPY_ENABLED:
+            raise Exception('ArrayJointParticleFilter requires numpy')
+        self.numGhosts = gameState.getNumAgents() - 1
+        self.ghostAgents = []
+        self.legalPositions = legalPositions
+        jailPositions = [self.getJailPosition(i) for i in range(self.numGhosts)]
+        self.positions = legalPositions + [p for p in jailPositions if p not in legalPositions]
+        self.positionIndex = dict([(p, i) for i, p in enumerate(self.positions)])
+        self.jailIndices = numpy.array([self.positionIndex[p] for p in jailPositions])
+        self.observationModel = ObservationModel(self.positions, jailPositions, gameState.getWalls())
+        self.rng = numpy.random.RandomState(random.randint(0, 2 ** 31 - 1))
+        self.initializeParticles()
+
+    def initializeParticles(self):
+        """
+        Spreads the particles over a shuffled enumeration of the joint legal
+        positions, or draws them uniformly when there are too many joint
+        positions to enumerate.
+        """
+        numLegal = len(self.legalPositions)
+        numJoint = numLegal ** self.numGhosts
+        if numJoint <= max(self.numParticles, 100000):
+            codes = self.rng.permutation(numJoint)[numpy.arange(self.numParticles) % numJoint]
+            self.particles = numpy.empty((self.numParticles, self.numGhosts), dtype=int)
+            for i in range(self.numGhosts):
+                self.particles[:, i] = codes % numLegal
+                codes = codes // numLegal
+        else:
+            self.particles = self.rng.randint(0, numLegal, (self.numParticles, self.numGhosts))
+
+    def observeState(self, gameState):
+        "Weights the particles by the likelihood of every noisy distance and resamples them."
+        pacmanPosition = gameState.getPacmanPosition()
+        noisyDistances = gameState.getNoisyGhostDistances()
+        if len(noisyDistances) < self.numGhosts:
+            return
+
+        eaten = [i for i in range(self.numGhosts) if noisyDistances[i] == None]
+        weights = numpy.ones(len(self.particles))
+        for i in range(self.numGhosts):
+            if noisyDistances[i] != None:
+                weights *= self.observationModel.getLikelihoods(noisyDistances[i], pacmanPosition,
+                                                               self.particles[:, i])
+
+        if weights.sum() == 0:
+            self.initializeParticles()
+        else:
+            self.particles = self.particles[systematicResample(weights, self.numParticles, self.rng)]
+        for i in eaten:
+            self.particles[:, i] = self.jailIndices[i]
+
+    def elapseTime(self, gameState):
+        "Samples each particle's next joint position, grouping particles that share a joint position."
+        numPositions = len(self.positions)
+        codes = numpy.zeros(len(self.particles), dtype=numpy.int64)
+        for i in reversed(range(self.numGhosts)):
+            codes = codes * numPositions + self.particles[:, i]
+        jointCodes, firstMembers, groups = numpy.unique(codes, return_index=True, return_inverse=True)
+
+        rows = [[] for i in range(self.numGhosts)]
+        for member in firstMembers:
+            prevGhostPositions = [self.positions[j] for j in self.particles[member]]
+            setGhostPositions(gameState, prevGhostPositions)
+            for i in range(self.numGhosts):
+                newPosDist = getPositionDistributionForGhost(gameState, i, self.ghostAgents[i])
+                rows[i].append([(self.positionIndex[newPos], prob) for newPos, prob in newPosDist.items()
+                                if newPos in self.positionIndex and prob > 0])
+
+        newParticles = numpy.empty_like(self.particles)
+        for i in range(self.numGhosts):
+            successorTable, cumulativeTable = getSamplingTables(rows[i], self.particles[firstMembers, i])
+            newParticles[:, i] = sampleSuccessors(successorTable, cumulativeTable, groups, self.rng)
+        self.particles = newParticles
+
+    def getBeliefDistribution(self):
+        "Returns the joint distribution over tuples of ghost positions."
+        beliefs = util.Counter()
+        for particle in self.particles:
+            beliefs[tuple([self.positions[j] for j in particle])] += 1.0
+        beliefs.normalize()
+        return beliefs
+
+    def getMarginalDistribution(self, ghostIndex):
+        "Returns the belief over a single ghost's position, summing out the others."
+        counts = numpy.bincount(self.particles[:, ghostIndex], minlength=len(self.positions))
+        beliefs = util.Counter()
+        for j in numpy.flatnonzero(counts):
+            beliefs[self.positions[j]] = counts[j] / float(len(self.particles))
+        return beliefs
+
 # One JointInference module is shared globally across instances of MarginalInference
 jointInference = JointParticleFilter()
+arrayJointInference = ArrayJointParticleFilter()
 
 def getPositionDistributionForGhost(gameState, ghostIndex, agent):
     """